@@ -0,0 +1,394 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Run fio campaigns across the $LGS load generators, preparing all hosts concurrently
+"""
+__author__  = "Mark Butterworth"
+__version__ = "0.1.2 20261019"
+__license__ = "MIT"
+
+# Ver 0.1.0 20261019  Initial version, replaces the benmon runfiomaster/setup_node_exporter loops
+# Ver 0.1.1 20261019  Non zero RC when any run fails, --probe-host, fio server sessions are reaped
+# Ver 0.1.2 20261019  reap() also kills the remote fio servers, --ready-timeout
+
+# MIT License
+
+# Copyright (c) 2023 Mark Butterworth
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import sys
+import os
+import re
+import shlex
+import signal
+import asyncio
+import argparse
+import itertools
+import subprocess
+
+from typing import Dict, List, Tuple, Optional
+from pathlib import Path
+from datetime import datetime, timezone
+
+DEBUG = 0
+VERBOSE = 0
+FORCE = False
+
+SSH = 'ssh -o StrictHostKeyChecking=no'
+SCP = 'scp -o StrictHostKeyChecking=no'
+REMOTE_FIO = '/tmp/fio'
+REMOTE_NODE_EXPORTER = '/tmp/node_exporter'
+FIO_SERVER_PORT = 8765
+READY_TIMEOUT = 30
+RESULTROOT = '/tmp/fio_results'
+
+###############################################################################
+
+
+def sigterm_handler(signo, stack_frame):
+    print(f'{signal.strsignal(signo)} received, Exiting...')
+    # Raises SystemExit(0):
+    sys.exit(0)
+
+signal.signal(signal.SIGTERM, sigterm_handler)
+
+
+def utc_timestamp() -> str:
+    return datetime.now(timezone.utc).strftime('%Y%m%d_%H%M%S')
+
+
+def natural_key(text: str) -> List:
+    return [ int(x) if x.isdigit() else x for x in re.split(r'(\d+)', text) ]
+
+
+class Hosts:
+    '''Run ssh/scp against the load generators with bounded parallelism
+    '''
+    def __init__(self, parallel: int, ssh: str=SSH, scp: str=SCP):
+        self.sem = asyncio.Semaphore(parallel)
+        self.ssh = shlex.split(ssh)
+        self.scp = shlex.split(scp)
+        self.sessions: List[Tuple[str, str, subprocess.Popen]] = []     # (host, program, ssh session)
+
+    async def run(self, argv: List[str], check: bool=False) -> Tuple[int, str]:
+        if DEBUG:
+            print('cmd:', argv)
+        async with self.sem:
+            proc = await asyncio.create_subprocess_exec(*argv, stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+            stdout, stderr = await proc.communicate()
+        if DEBUG > 1:
+            print('stdout:', stdout.decode(errors='replace'))
+            print('stderr:', stderr.decode(errors='replace'))
+        if check and proc.returncode:
+            raise RuntimeError(f'{" ".join(argv)} failed RC={proc.returncode}: {stderr.decode(errors="replace").strip()}')
+        return proc.returncode, stdout.decode(errors='replace')
+
+    async def remote(self, host: str, command: str, check: bool=False) -> Tuple[int, str]:
+        return await self.run(self.ssh + [host, command], check)
+
+    async def copy(self, source: str, host: str, target: str):
+        await self.run(self.scp + [source, f'{host}:{target}'], check=True)
+
+    async def kill(self, host: str, program: str, quiet: bool=False):
+        rc, pids = await self.remote(host, f'pidof {program}')
+        if pids.strip():
+            if not quiet:
+                print(f'WARNING: killing {program} PID(s) {pids.strip()} on LG: {host}')
+            await self.remote(host, f'pkill {program}')
+
+    def background(self, host: str, program: str, command: str, logfile: Path) -> subprocess.Popen:
+        # Long running sessions (e.g. fio --server), ended by reap() once the campaign is done
+        with open(logfile, 'wb') as log:
+            proc = subprocess.Popen(self.ssh + [host, command], stdin=subprocess.DEVNULL,
+                                    stdout=log, stderr=subprocess.STDOUT, start_new_session=True)
+        self.sessions.append((host, program, proc))
+        return proc
+
+    async def reap(self, timeout: float=5):
+        # The remote program outlives its ssh session, so kill it on the host as well
+        targets = sorted({ (host, program) for host, program, _ in self.sessions })
+        results = await asyncio.gather(*[ self.kill(host, program, quiet=True) for host, program in targets ],
+                                       return_exceptions=True)
+        for (host, program), result in zip(targets, results):
+            if isinstance(result, Exception):
+                print(f'WARNING: {host}: failed to stop {program}: {result}')
+        for _, _, proc in self.sessions:
+            if proc.poll() is None:
+                proc.terminate()
+        for _, _, proc in self.sessions:
+            try:
+                proc.wait(timeout)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+                proc.wait()
+        self.sessions = []
+
+
+async def discover_devices(hosts: Hosts, host: str) -> List[str]:
+    '''Hitachi OPEN-V SCSI devices (lsscsi) followed by Hitachi NVMe namespaces (lsblk)
+    '''
+    (_, lsscsi), (_, lsblk) = await asyncio.gather(
+        hosts.remote(host, 'lsscsi'),
+        hosts.remote(host, 'lsblk -o NAME,SERIAL,WWN,MODEL'))
+    devices = []
+    for line in lsscsi.splitlines():
+        cols = line.split()
+        if 'OPEN-V' in line and len(cols) >= 6:
+            devices.append(cols[5])
+    nvme = [ '/dev/' + line.split()[0] for line in lsblk.splitlines()
+             if re.search(r'nvme.*HITACHI', line) ]
+    return devices + sorted(nvme, key=natural_key)
+
+
+async def wait_port(host: str, port: int, timeout: float=READY_TIMEOUT) -> bool:
+    '''Poll until a TCP connection to host:port succeeds
+    '''
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while loop.time() < deadline:
+        try:
+            _, writer = await asyncio.wait_for(asyncio.open_connection(host, port), 2)
+            writer.close()
+            await writer.wait_closed()
+            return True
+        except (OSError, asyncio.TimeoutError):
+            await asyncio.sleep(0.2)
+    return False
+
+
+async def prepare_fio_host(hosts: Hosts, host: str, fioprog: str, port: int, probe: str='{host}',
+                           timeout: float=READY_TIMEOUT) -> List[str]:
+    devices, _ = await asyncio.gather(
+        discover_devices(hosts, host),
+        hosts.kill(host, 'fio'))
+    print(f'{host}: Hitachi Storage Device List: {":".join(devices)}')
+    await hosts.copy(fioprog, host, REMOTE_FIO)
+    clientlog = Path(f'/tmp/fioclient.{host}.{utc_timestamp()}.log')
+    print(f'RUNNING SERVER: {host}: fio server outputing to: {clientlog}')
+    proc = hosts.background(host, 'fio', f'{REMOTE_FIO} --server', clientlog)
+    address = probe.format(host=host)
+    if not await wait_port(address, port, timeout):
+        if proc.poll() is not None:
+            raise RuntimeError(f'fio server session to {host} exited RC={proc.returncode}, see: {clientlog}')
+        raise RuntimeError(f'fio server on {address}:{port} not ready after {timeout:g} seconds, see: {clientlog}')
+    return devices
+
+
+def render_jobfile(text: str, settings: Dict[str, str]) -> str:
+    '''Replace the value of each "key=" line in a fio job file
+    '''
+    for key, value in settings.items():
+        text = re.sub(rf'^{re.escape(key)}=.*$', lambda _: f'{key}={value}', text, flags=re.MULTILINE)
+    return text
+
+
+def parse_loop(loop: Optional[str]) -> List[Optional[str]]:
+    return [ v for v in loop.split(',') if v ] if loop else [None]
+
+
+async def run_campaign(hostnames: List[str], jobfiles: List[str], args) -> int:
+    hosts = Hosts(args.parallel, args.ssh, args.scp)
+    try:
+        return await run_fio_jobs(hosts, hostnames, jobfiles, args)
+    finally:
+        await hosts.reap()
+
+
+async def run_fio_jobs(hosts: Hosts, hostnames: List[str], jobfiles: List[str], args) -> int:
+    print('Running fio in server mode on clients:')
+    results = await asyncio.gather(*[ prepare_fio_host(hosts, h, args.fio, args.port, args.probe_host,
+                                                       args.ready_timeout)
+                                      for h in hostnames ], return_exceptions=True)
+    failed = [ (h, r) for h, r in zip(hostnames, results) if isinstance(r, Exception) ]
+    for host, error in failed:
+        print(f'ERROR: {host}: {error}')
+    if failed:
+        return 30
+    devices = dict(zip(hostnames, results))
+    print('')
+
+    resultroot = Path(args.resultroot)
+    resultroot.mkdir(parents=True, exist_ok=True)
+    jobdir = Path(args.jobdir)
+    combinations = list(itertools.product(jobfiles, parse_loop(args.loop1), parse_loop(args.loop2)))
+    failed = []
+    lastjob = None
+    for n, (jobfile, val1, val2) in enumerate(combinations):
+        jobname = Path(jobfile).name
+        if jobfile != lastjob:
+            print(f'Starting job file: {jobfile}\n')
+            lastjob = jobfile
+        template = Path(jobfile).read_text()
+        settings = {}
+        if val1 is not None:
+            settings[args.set1] = val1
+            print(f'Custom $LOOP1: {args.set1} = {val1}')
+        if val2 is not None:
+            settings[args.set2] = val2
+            print(f'Custom $LOOP2: {args.set2} = {val2}')
+
+        clientopt = []
+        for host in hostnames:
+            hostjob = jobdir / f'{jobname}.{host}'
+            hostjob.write_text(render_jobfile(template, dict(settings, filename=':'.join(devices[host]))))
+            clientopt += [ f'--client={host}', str(hostjob) ]
+
+        outputlog = jobname
+        if val1 is not None:
+            outputlog += f'_{args.set1}{val1}'
+        if val2 is not None:
+            outputlog += f'_{args.set2}{val2}'
+        outputlog = resultroot / f'{outputlog}_{utc_timestamp()}.log'
+        print(f'RUNNING CLIENT: fio output log = {outputlog}')
+        cmd = [ args.fio ] + shlex.split(args.fioparams) + [ '--eta=always', '--eta-interval=5s',
+                f'--output={outputlog}' ] + clientopt
+        print(' '.join(cmd))
+        print('...')
+        proc = await asyncio.create_subprocess_exec(*cmd)
+        rc = await proc.wait()
+        if outputlog.exists():
+            output = outputlog.read_text(errors='replace')
+            if 'All clients' in output:
+                print(output[output.index('All clients'):])
+        print(f'\nfio RC={rc}')
+        print(f'Detailed Results output: {outputlog}')
+        if rc:
+            failed.append(outputlog)
+        if n+1 < len(combinations):
+            print(f'\n{datetime.now():%H:%M:%S}: Waiting $FIOWAIT={args.wait:g} seconds ...')
+            await asyncio.sleep(args.wait)
+            print('\n')
+    if failed:
+        print(f'\nERROR: {len(failed)} of {len(combinations)} fio runs failed:')
+        for outputlog in failed:
+            print(f'  {outputlog}')
+        return 30
+    return 0
+
+
+async def setup_node_exporter(hostnames: List[str], nepath: str, args) -> int:
+    hosts = Hosts(args.parallel, args.ssh, args.scp)
+
+    async def setup(host: str):
+        await hosts.kill(host, 'node_exporter')
+        await hosts.copy(nepath, host, '/tmp')
+        print(f'{host} running: {REMOTE_NODE_EXPORTER}')
+        await hosts.remote(host, f'bash -c "( ( cd /tmp && nohup {REMOTE_NODE_EXPORTER} '
+                                 f'> /tmp/node_exporter_{utc_timestamp()}.log 2>&1 < /dev/null & ) )"', check=True)
+
+    results = await asyncio.gather(*[ setup(h) for h in hostnames ], return_exceptions=True)
+    rc = 0
+    for host, result in zip(hostnames, results):
+        if isinstance(result, Exception):
+            print(f'ERROR: {host}: {result}')
+            rc = 30
+    return rc
+
+
+def cli():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.version = __version__
+    parser.add_argument('-V', '--version', action='version')
+    parser.add_argument('-D', '--debug', action='count',
+        help='Increase debug level, e.g. -DDD = level 3.')
+    parser.add_argument('-v', '--verbose', action='count',
+        help='Increase verbose level, e.g. -vv = level 2.')
+    parser.add_argument('-f', '--force', action='store_true',
+         help='Force')
+    parser.add_argument('-l', '--lgs', type=str, default=os.environ.get('LGS', ''),
+         help='Load Generator hosts with passwordless ssh access (default: $LGS)')
+    parser.add_argument('-p', '--parallel', type=int, default=16,
+         help='Maximum concurrent ssh/scp commands')
+    parser.add_argument('--ssh', type=str, default=SSH,
+         help='ssh command, e.g. a local fake for testing')
+    parser.add_argument('--scp', type=str, default=SCP,
+         help='scp command, e.g. a local fake for testing')
+    parser.add_argument('--fio', type=str, default=os.environ.get('FIOPROG', 'fio'),
+         help='Local fio executable, also copied to the clients (default: $FIOPROG)')
+    parser.add_argument('--fioparams', type=str, default=os.environ.get('FIOPARAMS', ''),
+         help='Extra fio client parameters (default: $FIOPARAMS)')
+    parser.add_argument('--port', type=int, default=FIO_SERVER_PORT,
+         help='fio server port probed for readiness')
+    parser.add_argument('--probe-host', type=str, default='{host}',
+         help='Address probed for fio server readiness, {host} is the client, e.g. {host}-data or 127.0.0.1')
+    parser.add_argument('--ready-timeout', type=float, default=READY_TIMEOUT,
+         help='Seconds to wait for each fio server to accept connections')
+    parser.add_argument('--resultroot', type=str, default=os.environ.get('RESULTROOT', RESULTROOT),
+         help='Directory for the fio output logs (default: $RESULTROOT)')
+    parser.add_argument('--jobdir', type=str, default='/tmp',
+         help='Directory for the generated per host job files')
+    parser.add_argument('--wait', type=float, default=float(os.environ.get('FIOWAIT', 1)),
+         help='Seconds to wait between runs (default: $FIOWAIT)')
+    parser.add_argument('--loop1', type=str, default=os.environ.get('LOOP1'),
+         help='Comma separated values for --set1 (default: $LOOP1)')
+    parser.add_argument('--set1', type=str, default=os.environ.get('SET1'),
+         help='Job file option set from --loop1 (default: $SET1)')
+    parser.add_argument('--loop2', type=str, default=os.environ.get('LOOP2'),
+         help='Comma separated values for --set2 (default: $LOOP2)')
+    parser.add_argument('--set2', type=str, default=os.environ.get('SET2'),
+         help='Job file option set from --loop2 (default: $SET2)')
+    parser.add_argument('--node-exporter', type=str,
+         help='Instead of fio, copy and start this node_exporter executable on the clients')
+    parser.add_argument('jobfiles', type=str, nargs='*',
+         help='fio job files to run in order')
+
+    args = parser.parse_args()
+    global DEBUG, VERBOSE, FORCE
+    if args.debug:
+        DEBUG = args.debug
+        print('Python version:', sys.version)
+        print('DEBUG LEVEL:', args.debug)
+        print('Arguments:', args)
+
+    if sys.version_info < (3, 9):
+        print('ERROR: Minimum required python version is 3.9')
+        return 10
+
+    VERBOSE = args.verbose
+
+    hostnames = args.lgs.split()
+    if not hostnames:
+        print('ERROR: $LGS needs to be set to a list of Load Generator client hosts with passwordless ssh access')
+        return 20
+
+    if args.node_exporter:
+        return asyncio.run(setup_node_exporter(hostnames, args.node_exporter, args))
+
+    if args.loop1 and not args.set1:
+        print('ERROR: $LOOP1 is set without $SET1')
+        return 20
+    if args.loop2 and not args.set2:
+        print('ERROR: $LOOP2 is set without $SET2')
+        return 20
+    if not Path(args.fio).is_file() or not os.access(args.fio, os.X_OK):
+        print('ERROR: requires the fio utility: fio not found')
+        return 20
+    for jobfile in args.jobfiles:
+        if not Path(jobfile).is_file():
+            print(f'ERROR: fio job file not found: {jobfile}')
+            return 20
+
+    return asyncio.run(run_campaign(hostnames, args.jobfiles, args))
+
+
+if __name__=='__main__':
+    retcode = cli()
+    exit(retcode)
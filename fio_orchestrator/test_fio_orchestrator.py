@@ -0,0 +1,159 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for fio_orchestrator: whole campaigns run against a fake ssh, scp and fio
+    cd fio_orchestrator && python -m unittest test_fio_orchestrator
+"""
+__author__  = "Mark Butterworth"
+__version__ = "0.1.0 20261019"
+__license__ = "MIT"
+
+# Ver 0.1.0 20261019  Initial version
+
+# MIT License, Copyright (c) 2023 Mark Butterworth, see LICENSE
+
+import os
+import sys
+import time
+import socket
+import tempfile
+import unittest
+import subprocess
+
+from pathlib import Path
+
+SCRIPT = Path(__file__).resolve().parent / 'fio_orchestrator.py'
+
+# The "remote" fio server is detached from its ssh session, as a real one is
+FAKE_SSH = '''#!/bin/bash
+host=$1; shift
+echo "$host $*" >> "$FAKE_DIR/ssh.log"
+pidfile="$FAKE_DIR/server.$host.pid"
+case "$*" in
+  lsscsi) echo "[0:0:0:1]  disk  HITACHI  OPEN-V  8001  /dev/sdb";;
+  lsblk*) echo "nvme10n1 S1 W1 HITACHI"; echo "nvme2n1 S2 W2 HITACHI";;
+  "pidof fio") [[ -f $pidfile ]] && kill -0 $(cat $pidfile) 2>/dev/null && cat $pidfile || exit 1;;
+  "pkill fio") kill $(cat $pidfile) && rm -f $pidfile;;
+  *--server*)
+    if [[ $FAKE_SERVER == down ]]; then
+      code="import time; time.sleep(60)"
+    else
+      code="import socket, time; s = socket.socket(); s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+s.bind(('127.0.0.1', $FAKE_PORT)); s.listen(); time.sleep(60)"
+    fi
+    setsid "$FAKE_PYTHON" -c "$code" < /dev/null > /dev/null 2>&1 &
+    echo $! > $pidfile
+    wait;;
+esac
+'''
+
+FAKE_SCP = '''#!/bin/bash
+echo "$*" >> "$FAKE_DIR/scp.log"
+'''
+
+# Fails any run whose output log is named after numjobs=4
+FAKE_FIO = '''#!/bin/bash
+echo "$*" >> "$FAKE_DIR/fio.log"
+for a in "$@"; do
+  case $a in --output=*) echo "All clients: fake" > "${a#--output=}"; [[ $a == *numjobs4* ]] && exit 1;; esac
+done
+exit 0
+'''
+
+JOBFILE = '''[global]
+filename=/dev/null
+numjobs=1
+[job]
+rw=randread
+'''
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    # A zombie still answers kill(0), check the process state
+    stat = Path(f'/proc/{pid}/stat')
+    return stat.exists() and stat.read_text().split(')')[-1].split()[0] != 'Z'
+
+
+class TestCampaign(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = Path(self.tmp.name)
+        for name, text in (('ssh', FAKE_SSH), ('scp', FAKE_SCP), ('fio', FAKE_FIO)):
+            (self.dir / name).write_text(text)
+            (self.dir / name).chmod(0o755)
+        (self.dir / 'job.fio').write_text(JOBFILE)
+        self.port = free_port()
+        self.server_pids = []
+
+    def tearDown(self):
+        for pid in self.server_pids:
+            if alive(pid):
+                os.kill(pid, 9)
+        self.tmp.cleanup()
+
+    def campaign(self, *extra, server='up') -> subprocess.CompletedProcess:
+        env = dict(os.environ, FAKE_DIR=str(self.dir), FAKE_PORT=str(self.port), FAKE_SERVER=server,
+                   FAKE_PYTHON=sys.executable, LGS='lg1')
+        argv = [ sys.executable, str(SCRIPT), '--ssh', str(self.dir / 'ssh'), '--scp', str(self.dir / 'scp'),
+                 '--fio', str(self.dir / 'fio'), '--port', str(self.port), '--probe-host', '127.0.0.1',
+                 '--resultroot', str(self.dir / 'results'), '--jobdir', str(self.dir), '--wait', '0',
+                 '--ready-timeout', '2' ] + list(extra) + [ str(self.dir / 'job.fio') ]
+        result = subprocess.run(argv, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                text=True, timeout=60)
+        pidfile = self.dir / 'server.lg1.pid'
+        self.server_pids = [ int(pidfile.read_text()) ] if pidfile.exists() else []
+        return result
+
+    def ssh_log(self):
+        return (self.dir / 'ssh.log').read_text().splitlines()
+
+    def assert_reaped(self, output: str):
+        # Both the remote fio server and its local ssh session are gone
+        self.assertIn('lg1 pkill fio', self.ssh_log())
+        self.assertFalse(self.server_pids)
+        time.sleep(0.2)
+        sessions = subprocess.run([ 'pgrep', '-f', f'{self.dir}/ssh lg1' ], stdout=subprocess.PIPE, text=True)
+        self.assertEqual(sessions.stdout, '', output)
+
+    def test_campaign(self):
+        result = self.campaign('--loop1', '1,8', '--set1', 'numjobs')
+        self.assertEqual(result.returncode, 0, result.stdout)
+        self.assertIn('Hitachi Storage Device List: /dev/sdb:/dev/nvme2n1:/dev/nvme10n1', result.stdout)
+        self.assertIn(f'{self.dir}/fio lg1:/tmp/fio', (self.dir / 'scp.log').read_text())
+        job = (self.dir / 'job.fio.lg1').read_text()
+        self.assertIn('filename=/dev/sdb:/dev/nvme2n1:/dev/nvme10n1\n', job)
+        self.assertIn('numjobs=8\n', job)
+        runs = (self.dir / 'fio.log').read_text().splitlines()
+        self.assertEqual(len(runs), 2)
+        self.assertIn(f'--client=lg1 {self.dir}/job.fio.lg1', runs[0])
+        self.assertEqual(len(list((self.dir / 'results').glob('job.fio_numjobs*.log'))), 2)
+        self.assert_reaped(result.stdout)
+
+    def test_failed_run(self):
+        result = self.campaign('--loop1', '1,4,8', '--set1', 'numjobs')
+        self.assertEqual(result.returncode, 30, result.stdout)
+        self.assertEqual(len((self.dir / 'fio.log').read_text().splitlines()), 3)     # later runs still go ahead
+        self.assertIn('ERROR: 1 of 3 fio runs failed:', result.stdout)
+        self.assertRegex(result.stdout, r'\n  \S+/job\.fio_numjobs4_\d{8}_\d{6}\.log\n')
+        self.assert_reaped(result.stdout)
+
+    def test_server_never_ready(self):
+        result = self.campaign(server='down')
+        self.assertEqual(result.returncode, 30, result.stdout)
+        self.assertIn(f'ERROR: lg1: fio server on 127.0.0.1:{self.port} not ready after 2 seconds', result.stdout)
+        self.assertFalse((self.dir / 'fio.log').exists())
+        self.assert_reaped(result.stdout)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,10 +4,12 @@
 Convert export data to open metrics for backfilling with promtool into prometheus
 """
 __author__  = "Mark Butterworth"
-__version__ = "0.1.0 20250103"
+__version__ = "0.2.1 20261019"
 __license__ = "MIT"
 
 # Ver 0.1.0 20250217  Initial version
+# Ver 0.2.0 20261019  Shared bytes flatfile parser (vdb_exporter/vdb_flatfile.py)
+# Ver 0.2.1 20261019  vdb_flatfile imported as an installed module (pip install -e . at the repo root)
 
 # MIT License
 
@@ -40,6 +42,12 @@ from pathlib import Path
 from datetime import datetime
 from socket import gethostname
 
+import prometheus_client
+from prometheus_client import REGISTRY, start_http_server, CollectorRegistry, Gauge
+
+# The flatfile parser is shared with the vdb_exporter tools, installed by the repo's
+# setup.py: pip install -e . (or uv sync)
+from vdb_flatfile import FlatfileParser, follow_rows
 
 DEBUG = 0
 VERBOSE = 0
@@ -104,25 +112,6 @@ def vdb_alive(pid: int) -> bool:
     return False
 
 
-def follow(fd: TextIO , timeout: int=60, pid: int=0):
-    '''generator function that yields new lines added to a file
-    '''
-    start = time.perf_counter()
-    while True:
-        line = fd.readline()
-        if not line:
-            if timeout and time.perf_counter() >= start+timeout:
-                print(f'\nWARNING: {timeout}sec timeout following: {fd.name}')
-                break
-            if pid and not vdb_alive(pid):
-                print(f'\nWARNING: Vdbench process no longer alive: {pid}')
-                break
-            time.sleep(0.25)
-            continue
-        yield line
-        start = time.perf_counter()
-
-
 def process_flatfile(pid: int, flatfile: str, labels: Optional[dict]=None):
     labels['run'] = ''
   
@@ -130,53 +119,34 @@ def process_flatfile(pid: int, flatfile: str, labels: Optional[dict]=None):
     #    - Once destroyed will clear out prevous metrics.
     registry = CollectorRegistry()
     REGISTRY.register(registry)
-    header = None
-    with open(flatfile, 'r') as fd:
-        for line in follow(fd, 60):
-            line = line.strip()
-            if 'tod' in line:
-                header = line.split()
-                break
-        
-        if not header:
-            print(f'ERROR: Header not found in flatfile: {fd.name}')
-            return
-
-        header = [ x.lower().replace('/', '_').replace('%', '_pct') for x in header ]
-        print('Header:', header)
-        
-        gauges = { METRIC_PREFIX + k: Gauge(METRIC_PREFIX + k , '', labels.keys(), registry=registry) 
-                  for k in header[3:] }
-        if DEBUG:
-            print(gauges)
-
-        # fd.seek(0, os.SEEK_END)   # Go to end so we get the latest Summary Info
-        lastrun = ''
-        for line in follow(fd, 15, pid):
-            values = line.split()
-            if values[3].startswith('avg'):
-                continue
-            # logtime = values[1][:10] + ' ' + values[0]
-            # timestamp = datetime.strptime(logtime, DATETIME_FORMAT).timestamp()
-            run = values[2]
-            if run != lastrun:
-                print(f'\n{datetime.now().strftime("%Y-%m-%d %H:%M:%S")} Monitoring run: {run} ', end='')
-                for k in gauges:
-                    gauges[k].clear()
-                lastrun = run
-            labels['run'] = run
-            for i, val in enumerate(values[3:]):
-                metric = METRIC_PREFIX + header[i+3]
-                # gauges[metric]._timestamp = timestamp
-                if val == 'n/a':
-                    val = '0'
+    parser = FlatfileParser()
+    gauges = None
+    lastrun = ''
+    with open(flatfile, 'rb') as fd:
+        for row in follow_rows(fd, parser, 15, 60, lambda: vdb_alive(pid)):
+            if gauges is None:
+                print('Header:', parser.header.names)
+                gauges = [ Gauge(METRIC_PREFIX + k , '', labels.keys(), registry=registry)
+                           for k in parser.header.columns ]
                 if DEBUG:
-                    print(metric, labels, val)
-                gauges[metric].labels(**labels).set(val)
+                    print(gauges)
+            if row.run != lastrun:
+                print(f'\n{datetime.now().strftime("%Y-%m-%d %H:%M:%S")} Monitoring run: {row.run} ', end='')
+                for gauge in gauges:
+                    gauge.clear()
+                lastrun = row.run
+            labels['run'] = row.run
+            for gauge, val in zip(gauges, row.values):
+                if DEBUG:
+                    print(gauge, labels, val)
+                gauge.labels(**labels).set(val)
             if not DEBUG:
                 print('.', end='')
-        # Once complete unregister to avoid "Duplicate Metrics" errors:
-        REGISTRY.unregister(registry)
+
+    if not parser.header:
+        print(f'ERROR: Header not found in flatfile: {flatfile}')
+    # Once complete unregister to avoid "Duplicate Metrics" errors:
+    REGISTRY.unregister(registry)
 
 
 def vdb_proc_monitor():
@@ -4,10 +4,17 @@
 Monitor Hitachi RAID Manager "raidcfg" to gather elapsed and processing used counters
 """
 __author__  = "Mark Butterworth"
-__version__ = "0.1.0 20250304"
+__version__ = "0.4.4 20261019"
 __license__ = "MIT"
 
 # Ver 0.1.0 20250217  Initial version
+# Ver 0.2.0 20261019  Cached, compressed and conditional /metrics exposition
+# Ver 0.3.0 20261019  Per source collection cadence, timeout and age (serial once, power 60s, MP stats --interval)
+# Ver 0.4.0 20261019  Raw counter journal (--journal), replay (--replay) and OpenMetrics conversion (--openmetrics)
+# Ver 0.4.1 20261019  Refresh the exposition after failed collections, drop series of a superseded serial
+# Ver 0.4.2 20261019  Render the exposition in update() once the collection cycle is applied
+# Ver 0.4.3 20261019  Journal records sized by the MP count, --openmetrics streams each family from the journal
+# Ver 0.4.4 20261019  Each source on its own thread, serial and power from one raidcom get system source
 
 # MIT License
 
@@ -38,15 +45,27 @@ import psutil
 import time
 import signal
 import subprocess
+import threading
+import gzip
+import zlib
+import math
 
-from typing import Tuple, Optional, Union, TextIO, Dict
+from contextlib import nullcontext
+from typing import Any, Callable, Tuple, Optional, Union, TextIO, Dict, List
 from pathlib import Path
 from datetime import datetime
 from socket import gethostname
 from shutil import which
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from email.utils import formatdate, parsedate_to_datetime
+from urllib.parse import urlsplit
 
 import prometheus_client
-from prometheus_client import REGISTRY, start_http_server, CollectorRegistry, Gauge
+from prometheus_client import REGISTRY, CollectorRegistry, Gauge, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from prometheus_client.openmetrics import exposition as openmetrics
+
+import hitmp_journal
 
 DEBUG = 0
 VERBOSE = 0
@@ -93,6 +112,128 @@ HEADER_TRANSLATE = {
 
 
 
+class CachedExposition:
+    '''Render the registry once per data update and share the bytes with every scraper.
+
+    update() is called once a collection cycle has been fully applied and renders both
+    the plain and gzip compressed bodies for each exposition format (Prometheus text and
+    OpenMetrics) there and then, so scrapes never see a mix of old and new values.
+    '''
+    def __init__(self, registry: CollectorRegistry=REGISTRY):
+        self.registry = registry
+        self._lock = threading.Lock()
+        self._version = 0
+        self._updated = time.time()
+        self._cache = {}
+
+    def _render(self, use_openmetrics: bool, version: int, updated: float) -> Tuple[bytes, bytes, str, float]:
+        if use_openmetrics:
+            body = openmetrics.generate_latest(self.registry)
+        else:
+            body = generate_latest(self.registry)
+        etag = f'"{version}-{zlib.crc32(body):08x}"'
+        entry = (body, gzip.compress(body, 6), etag, updated)
+        if DEBUG > 1:
+            print(f'Rendered exposition: openmetrics={use_openmetrics} bytes={len(body)} gzip={len(entry[1])}')
+        return entry
+
+    def update(self):
+        version, updated = self._version + 1, time.time()
+        cache = { fmt: self._render(fmt, version, updated) for fmt in (False, True) }
+        with self._lock:
+            self._version, self._updated, self._cache = version, updated, cache
+
+    def get(self, use_openmetrics: bool) -> Tuple[bytes, bytes, str, float]:
+        with self._lock:
+            entry = self._cache.get(use_openmetrics)
+            if entry is None:    # Before the first update()
+                entry = self._cache[use_openmetrics] = self._render(use_openmetrics, self._version, self._updated)
+            return entry
+
+
+def _accepts(header: Optional[str], token: str) -> bool:
+    # True if token is listed in an Accept/Accept-Encoding header without q=0
+    for item in (header or '').split(','):
+        params = item.strip().split(';')
+        if params[0].strip().lower() != token:
+            continue
+        for param in params[1:]:
+            name, _, value = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    return float(value) > 0
+                except ValueError:
+                    return False
+        return True
+    return False
+
+
+class CachedMetricsHandler(BaseHTTPRequestHandler):
+    cache: CachedExposition = None
+
+    def do_GET(self):
+        self._respond(send_body=True)
+
+    def do_HEAD(self):
+        self._respond(send_body=False)
+
+    def _respond(self, send_body: bool):
+        if urlsplit(self.path).path not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        use_openmetrics = _accepts(self.headers.get('Accept'), 'application/openmetrics-text')
+        body, gzbody, etag, updated = self.cache.get(use_openmetrics)
+        use_gzip = _accepts(self.headers.get('Accept-Encoding'), 'gzip')
+        if use_gzip:
+            body, etag = gzbody, etag[:-1] + '-gz"'
+        lastmod = formatdate(updated, usegmt=True)
+
+        if self._not_modified(etag, updated):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Last-Modified', lastmod)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', openmetrics.CONTENT_TYPE_LATEST if use_openmetrics else CONTENT_TYPE_LATEST)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', lastmod)
+        self.send_header('Vary', 'Accept, Accept-Encoding')
+        if use_gzip:
+            self.send_header('Content-Encoding', 'gzip')
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def _not_modified(self, etag: str, updated: float) -> bool:
+        inm = self.headers.get('If-None-Match')
+        if inm:   # If-None-Match takes precedence over If-Modified-Since
+            tags = [ t.strip().removeprefix('W/') for t in inm.split(',') ]
+            return '*' in tags or etag in tags
+        ims = self.headers.get('If-Modified-Since')
+        if ims:
+            try:
+                return int(updated) <= parsedate_to_datetime(ims).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def log_message(self, format, *args):
+        if DEBUG > 1:
+            super().log_message(format, *args)
+
+
+def start_cached_http_server(port: int, cache: CachedExposition, addr: str='') -> ThreadingHTTPServer:
+    handler = type('Handler', (CachedMetricsHandler,), { 'cache': cache })
+    httpd = ThreadingHTTPServer((addr, port), handler)
+    httpd.daemon_threads = True
+    thread = threading.Thread(target=httpd.serve_forever, name='metrics_http', daemon=True)
+    thread.start()
+    return httpd
+
+
 def sigterm_handler(signo, stack_frame):
     print(f'{signal.strsignal(signo)} received, Exiting...')
     # Raises SystemExit(0):
@@ -102,105 +243,314 @@ signal.signal(signal.SIGTERM, sigterm_handler)
 signal.signal(signal.SIGINT, sigterm_handler)
 
 
-def get_serialno_power() -> Tuple[str, str]:
+class Source:
+    '''One collected data source with its own cadence, timeout and cached last value.
+
+    fetch(timeout) returns the new value, apply(value) publishes it. A failed or timed
+    out fetch keeps the previous value (and gauges), which shows up as a growing age.
+    An interval of 0 fetches once, retrying every RETRY_INTERVAL until it succeeds.
+    '''
+    RETRY_INTERVAL = 15
+
+    def __init__(self, name: str, interval: float, timeout: float,
+                 fetch: Callable[[float], Any], apply: Optional[Callable[[Any], None]]=None):
+        self.name = name
+        self.interval = interval
+        self.timeout = timeout
+        self.fetch = fetch
+        self.apply = apply
+        self.value = None
+        self.updated = None      # epoch of the last successful fetch
+        self.duration = 0.0
+        self.failures = 0
+        self.next_due = 0.0      # time.monotonic(), None when no longer scheduled
+
+    def run(self, lock: Optional[threading.Lock]=None) -> bool:
+        # lock serialises apply() with the other sources and the exposition rendering
+        start = time.monotonic()
+        try:
+            value = self.fetch(self.timeout)
+            if self.apply:
+                with lock or nullcontext():
+                    self.apply(value)
+        except (subprocess.SubprocessError, OSError, ValueError) as e:
+            self.failures += 1
+            print(f'\nWARNING: {self.name} collection failed: {e}')
+            self.next_due = start + (min(self.interval, self.RETRY_INTERVAL) if self.interval else self.RETRY_INTERVAL)
+            return False
+        finally:
+            self.duration = time.monotonic() - start
+        self.value = value
+        self.updated = time.time()
+        if not self.interval:
+            self.next_due = None
+        else:
+            # Fixed rate, skipping missed slots rather than bunching up behind a slow fetch
+            self.next_due += self.interval
+            if self.next_due <= time.monotonic():
+                self.next_due = start + self.interval
+        return True
+
+
+class SourceCollector:
+    '''Expose the age, last duration and failures of each collection source
+    '''
+    def __init__(self, sources: List[Source], hostname: str):
+        self.sources = sources
+        self.hostname = hostname
+
+    def collect(self):
+        age = GaugeMetricFamily(METRIC_PREFIX + 'source_age_seconds',
+                                'Seconds since the source value was last collected', labels=['hostname', 'source'])
+        duration = GaugeMetricFamily(METRIC_PREFIX + 'source_duration_seconds',
+                                     'Duration of the last source collection', labels=['hostname', 'source'])
+        failures = CounterMetricFamily(METRIC_PREFIX + 'source_failures',
+                                       'Failed or timed out source collections', labels=['hostname', 'source'])
+        now = time.time()
+        for source in self.sources:
+            labels = [self.hostname, source.name]
+            if source.updated is not None:
+                age.add_metric(labels, now - source.updated)
+            duration.add_metric(labels, source.duration)
+            failures.add_metric(labels, source.failures)
+        yield age
+        yield duration
+        yield failures
+
+
+def run_sources(sources: List[Source], cache: Optional[CachedExposition]=None):
+    '''Run each source on its own thread so a slow fetch never delays the others, re-rendering
+    the exposition after every attempt so the source age and failure metrics keep moving while
+    a source is failing. Returns once no source is scheduled any more.
+    '''
+    lock = threading.Lock()
+
+    def loop(source: Source):
+        while source.next_due is not None:
+            time.sleep(max(0, source.next_due - time.monotonic()))
+            source.run(lock)
+            if cache:
+                with lock:
+                    cache.update()
+
+    threads = [ threading.Thread(target=loop, args=(source,), name=f'source_{source.name}', daemon=True)
+                for source in sources ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def raidcom_system(timeout: float) -> Tuple[str, float]:
     cmd = f'{RAIDCOM} get system'.split()
     if DEBUG:
         print(f'cmd: {cmd}')
-    result = subprocess.run(cmd, capture_output=True, text=True)
+    result = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout)
     if DEBUG:
         print('stdout:', result.stdout)
         print('stderr:', result.stderr)
+    serialno, watts = None, None
     for line in result.stdout.split('\n'):
         if line.startswith('Serial'):
             serialno = line.split()[-1]
         if line.startswith('AVE(W)'):
-            watts = line.split()[-1]
+            watts = float(line.split()[-1])
             break
+    if serialno is None or watts is None:
+        raise ValueError(f'Serial# or AVE(W) not found in: {" ".join(cmd)}')
     return (serialno, watts)
 
 
-def mpstat_monitor(mpulookup: Dict, interval: int) -> int:
+def raidcfg_mpstats(timeout: float) -> List[List[str]]:
+    '''Query every MP bank, returns [header, row, row, ...] for the MP cores that exist
+    '''
+    deadline = time.monotonic() + timeout
+    headers = None
+    rows = []
+    for mpbank in range(16):
+        cmd = f'{RAIDCFG} -a qry -o stat -pmp {mpbank} 8'.split()
+        if DEBUG:
+            print(f'cmd: {cmd}')
+        result = subprocess.run(cmd, capture_output=True, text=True,
+                                timeout=max(0.1, deadline - time.monotonic()))
+        if DEBUG > 1:
+            print('stdout:\n', result.stdout)
+            print('stderr:\n', result.stderr)
+
+        for line in result.stdout.split('\n'):
+            if line.startswith(HEADER_MATCH):
+                headers = line.split()
+            elif line:
+                cols = line.split()
+                if cols[1] == '0x00000000':
+                    continue   # Skip if no elasped time, i.e. MP core does not exist
+                rows.append(cols)
+    if not headers:
+        raise ValueError('No MP statistics returned by raidcfg')
+    return [headers] + rows
+
+
+class MPGauges:
+    '''The hitmp gauges and how the collected values are applied to them (live, replay and conversion)
+    '''
+    def __init__(self, registry: CollectorRegistry, hostname: str, mpulookup: Dict):
+        self.mpulookup = mpulookup
+        self.power_labels = { 'hostname': hostname, 'serialno': '????????', 'MPid': '???', 'MPU': '?????' }
+        self.power_gauge = Gauge(METRIC_PREFIX + 'power_watts', 'Storage Power usage (Watts)', self.power_labels.keys(), registry=registry)
+        self.elapsed_labels = { 'hostname': hostname, 'serialno': '????????', 'MPid': '???', 'MPU': '?????' }
+        self.elapsed_gauge = Gauge(METRIC_PREFIX + 'elapsed_total', 'Total elapsed time during the measurement (us)', self.elapsed_labels.keys(), registry=registry)
+        self.coretime_labels = { 'hostname': hostname, 'serialno': '????????', 'MPid': '000', 'MPU': '?????', 'mode': 'unknown' }
+        self.coretime_gauge = Gauge(METRIC_PREFIX + 'coretime_total', 'Core busy time over the elapsed period labeled by mode (us)', self.coretime_labels.keys(), registry=registry)
+
+    def serial(self, serialno: str):
+        for gauge, labels in ((self.power_gauge, self.power_labels), (self.elapsed_gauge, self.elapsed_labels),
+                              (self.coretime_gauge, self.coretime_labels)):
+            old = labels['serialno']
+            if old == serialno:
+                continue
+            # Drop the series published under the previous (e.g. not yet known '????????') serial
+            for metric in gauge.collect():
+                for sample in metric.samples:
+                    if sample.labels.get('serialno') == old:
+                        gauge.remove(*[ sample.labels[k] for k in labels ])
+            labels['serialno'] = serialno
+
+    def power(self, watts: float):
+        self.power_gauge.labels(**self.power_labels).set(watts)
+
+    def mpstats(self, stats: List[List[str]]):
+        elapsed_labels, coretime_labels = self.elapsed_labels, self.coretime_labels
+        headers = stats[0]
+        for cols in stats[1:]:
+            if self.mpulookup:
+                mpnum = int(cols[0])
+                for i in self.mpulookup:
+                    if mpnum >= i:
+                        mpuname = self.mpulookup[i]
+                elapsed_labels['MPU'] = mpuname
+                coretime_labels['MPU'] = mpuname
+            mpid = f'{int(cols[0]):03d}'
+            elapsed_labels['MPid'] = mpid
+            coretime_labels['MPid'] = mpid
+
+            elapsed = float(int(cols[1], 16))
+            if DEBUG > 2:
+                print('ELAPSED:', elapsed_labels, elapsed)
+            self.elapsed_gauge.labels(**elapsed_labels).set(elapsed)
+            for i, header in enumerate(headers):
+                if i < 2 or cols[i] == '0x00000000':
+                    continue
+                coretime = float(int(cols[i], 16))
+                coretime_labels['mode'] = HEADER_TRANSLATE[header]
+                if DEBUG > 2:
+                    print('CORETIME:', header, coretime_labels, coretime)
+                self.coretime_gauge.labels(**coretime_labels).set(coretime)
+
+    def record(self, record: hitmp_journal.Record):
+        if record.serialno:
+            self.serial(record.serialno)
+        if not math.isnan(record.watts):
+            self.power(record.watts)
+        self.mpstats(record.stats())
+
+
+def mpstat_monitor(mpulookup: Dict, interval: int, cache: Optional[CachedExposition]=None,
+                   power_interval: float=60, timeout: float=30,
+                   journal: Optional[hitmp_journal.JournalWriter]=None) -> int:
     hostname = os.environ.get('HITMP_EXPORTER_HOSTNAME', gethostname())
 
     registry = CollectorRegistry()
     REGISTRY.register(registry)
+    gauges = MPGauges(registry, hostname, mpulookup)
+
+    def apply_system(system: Tuple[str, float]):
+        gauges.serial(system[0])
+        gauges.power(system[1])
+
+    def apply_mpstats(stats: List[List[str]]):
+        gauges.mpstats(stats)
+        if journal:
+            serialno, watts = sources[0].value or (None, None)
+            try:
+                journal.append(time.time(), serialno, watts, stats)
+            except OSError as e:
+                print(f'\nWARNING: Cannot write journal: {e}')
+        print('.', end='')
+
+    # One raidcom get system reports both the serial number and the power:
+    sources = [
+        Source('system', power_interval, timeout, raidcom_system, apply_system),
+        Source('mpstat', interval, min(timeout, interval), raidcfg_mpstats, apply_mpstats),
+    ]
+    registry.register(SourceCollector(sources, hostname))
+    if DEBUG:
+        print('Sources:', ', '.join(f'{s.name}={s.interval}s' for s in sources))
+    run_sources(sources, cache)
 
-    # gauges = dict()
-    # for key in HEADER_TRANSLATE:
-    #     gauges[key] = Gauge(METRIC_PREFIX + HEADER_TRANSLATE[key][0] , HEADER_TRANSLATE[key][1], labels.keys(), registry=registry) 
-    power_labels = { 'hostname': hostname, 'serialno': '????????', 'MPid': '???', 'MPU': '?????' }
-    power_gauge = Gauge(METRIC_PREFIX + 'power_watts', 'Storage Power usage (Watts)', power_labels.keys(), registry=registry)
-    elapsed_labels = { 'hostname': hostname, 'serialno': '????????', 'MPid': '???', 'MPU': '?????' }
-    elapsed_gauge = Gauge(METRIC_PREFIX + 'elapsed_total', 'Total elapsed time during the measurement (us)', elapsed_labels.keys(), registry=registry)
-    coretime_labels = { 'hostname': hostname, 'serialno': '????????', 'MPid': '000', 'MPU': '?????', 'mode': 'unknown' }
-    coretime_gauge = Gauge(METRIC_PREFIX + 'coretime_total', 'Core busy time over the elapsed period labeled by mode (us)', coretime_labels.keys(), registry=registry)
-
-    # Gauge will scrape:
-    # raidcfg -a qry -o stat -pmp 0 8
-    # MP#   E-Time(us) B-Time(us)     OT(us)     OI(us)     OE(us)     MT(us)     ME(us)     BE(us)    Sys(us)
-    #   0   0x9aae6529 0xc1bd71d5 0xfcc8f3ab 0x00000000 0x00000000 0x00000000 0x00000000 0xae65ec34 0x168e91f6
-    #   1   0x9aa0c118 0x59190a80 0x55903954 0x00000000 0x00000000 0x00000000 0x00000000 0x9fa07938 0x63e857f4
-    #   2   0x9d10238a 0x0628bc93 0x4a0eb055 0x00000000 0x00000000 0x00000000 0x00000000 0x754d0c56 0x46ccffe8
-    #   3   0x9c24613b 0xdfb37f60 0xd9ebe538 0x00000000 0x00000000 0x00000000 0x00000000 0x6673303f 0x9f5469e9
-    #   4   0x98e3cb61 0x9d2b4afc 0xb5ce4a6d 0x00000000 0x00000000 0x00000000 0x00000000 0x6eca9bca 0x789264c5
-    #   5   0x97ef7c31 0xc8d8af15 0x5da53884 0x00000000 0x00000000 0x00000000 0x00000000 0x38e22b7e 0x32514b13
-    #   6   0x9aaf6fe4 0x4873beea 0xe7ca316d 0x00000000 0x00000000 0x00000000 0x00000000 0x7eac129f 0xe1fd7ade
-    #   7   0x99df5a0e 0xd8aca4d3 0x7a7565f9 0x00000000 0x00000000 0x00000000 0x00000000 0x44e10243 0x19563c97
+    REGISTRY.unregister(registry)
 
-    while True:
-        start_timer = time.perf_counter()
-
-        serialno, watts = get_serialno_power()
-        power_labels['serialno'] = serialno
-        power_gauge.labels(**power_labels).set(watts)
-
-        for mpbank in range(16):
-            cmd = f'{RAIDCFG} -a qry -o stat -pmp {mpbank} 8'.split()
-            if DEBUG:
-                print(f'cmd: {cmd}')
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            if DEBUG > 1:
-                print('stdout:\n', result.stdout)
-                print('stderr:\n', result.stderr)
-
-            for line in result.stdout.split('\n'):
-                if line.startswith(HEADER_MATCH):
-                    headers = line.split()
-                elif line:
-                    cols = line.split()
-                    if cols[1] == '0x00000000':
-                        continue   # Skip if no elasped time, i.e. MP core does not exist
-
-                    if mpulookup:
-                        mpnum = int(cols[0])
-                        for i in mpulookup:
-                            if mpnum >= i:
-                                mpuname = mpulookup[i]
-                        elapsed_labels['MPU'] = mpuname
-                        coretime_labels['MPU'] = mpuname
-                    mpid = f'{int(cols[0]):03d}'
-                    elapsed_labels['MPid'] = mpid
-                    coretime_labels['MPid'] = mpid
-
-                    elapsed = float(int(cols[1], 16))
-                    if DEBUG > 2:
-                        print('ELAPSED:', elapsed_labels, elapsed)
-                    elapsed_gauge.labels(**elapsed_labels).set(elapsed)
-                    for i, header in enumerate(headers):
-                        if i < 2 or cols[i] == '0x00000000':
-                            continue
-                        coretime = float(int(cols[i], 16))
-                        coretime_labels['mode'] = HEADER_TRANSLATE[header]
-                        if DEBUG > 2:
-                            print('CORETIME:', header, coretime_labels, coretime)
-                        coretime_gauge.labels(**coretime_labels).set(coretime)
-            print('.', end='')
-        duration = time.perf_counter() - start_timer
-        if DEBUG:
-            print('Loop Execution time (secs):', duration )
-        time.sleep(max(0, interval-duration))
 
-    REGISTRY.unregister(registry)
+def replay_journal(paths: List[str], mpulookup: Dict, cache: CachedExposition, speed: float=1.0,
+                   start: float=0, end: float=math.inf) -> int:
+    '''Serve a recorded journal through /metrics, paced by the recorded timestamps (repeats)
+    '''
+    registry = CollectorRegistry()
+    REGISTRY.register(registry)
+    gauges = None
+    while True:
+        last = None
+        replayed = 0
+        for hostname, record in hitmp_journal.read_journal(paths, start, end):
+            if gauges is None:
+                gauges = MPGauges(registry, os.environ.get('HITMP_EXPORTER_HOSTNAME', hostname), mpulookup)
+            if last is not None and speed > 0:
+                time.sleep(max(0, record.timestamp - last) / speed)
+            last = record.timestamp
+            gauges.record(record)
+            cache.update()
+            replayed += 1
+            if VERBOSE:
+                print(f'Replayed: {datetime.fromtimestamp(record.timestamp)}')
+            else:
+                print('.', end='')
+        if not replayed:
+            print(f'ERROR: No journal records found in: {" ".join(paths)}')
+            return 30
+        print(f'\nReplayed {replayed} records, restarting...')
+
+
+def journal_to_openmetrics(paths: List[str], outfile: str, mpulookup: Dict,
+                           start: float=0, end: float=math.inf) -> int:
+    '''Convert a journal window to timestamped OpenMetrics, for: promtool tsdb create-blocks-from openmetrics
+
+    Each metric family is one pass over the memory mapped journal, written out as it goes.
+    '''
+    first = next(hitmp_journal.read_journal(paths, start, end), None)
+    if first is None:
+        print(f'ERROR: No journal records found in: {" ".join(paths)}')
+        return 30
+    hostname = os.environ.get('HITMP_EXPORTER_HOSTNAME', first[0])
+    records = 0
+    with open(outfile, 'w') as fd:
+        for family in ('power_gauge', 'elapsed_gauge', 'coretime_gauge'):
+            gauges = MPGauges(CollectorRegistry(), hostname, mpulookup)
+            gauge = getattr(gauges, family)
+            header = True
+            records = 0
+            for _, record in hitmp_journal.read_journal(paths, start, end):
+                gauges.record(record)
+                records += 1
+                timestamp = f'{record.timestamp:.3f}'
+                for metric in gauge.collect():
+                    if header:
+                        fd.write(f'# TYPE {metric.name} gauge\n')
+                        header = False
+                    for sample in metric.samples:
+                        labels = ','.join(f'{k}="{v}"' for k, v in sample.labels.items())
+                        fd.write(f'{sample.name}{{{labels}}} {sample.value} {timestamp}\n')
+        fd.write('# EOF\n')
+    print(f'Wrote {records} records to: {outfile}')
+    return 0
 
 
 def check_raid_manager(rmdir: str):
@@ -228,7 +578,27 @@ def cli():
     parser.add_argument('-r', '--rmdir', type=str, default=HITMP_RMLOCATION,
          help='RAID Manager directory location ')
     parser.add_argument('-i', '--interval', type=int, default=15,
-         help='Intervals between collection')
+         help='Seconds between MP statistics collections')
+    parser.add_argument('-p', '--power-interval', type=int, default=60,
+         help='Seconds between serial number and power (raidcom get system) collections')
+    parser.add_argument('-t', '--timeout', type=float, default=30,
+         help='Maximum seconds for one source collection (MP statistics are also limited to --interval)')
+    parser.add_argument('-j', '--journal', type=str, default=os.environ.get('HITMP_JOURNAL'),
+         help='Append every MP collection to a raw counter journal in this directory')
+    parser.add_argument('--journal-size', type=int, default=64,
+         help='MiB per journal file before rotating')
+    parser.add_argument('--journal-keep', type=int, default=0,
+         help='Journal files to keep, 0 = keep all')
+    parser.add_argument('--replay', type=str, action='append',
+         help='Serve a recorded journal (file or directory) through /metrics instead of collecting')
+    parser.add_argument('--replay-speed', type=float, default=1.0,
+         help='Replay speed multiplier, 0 = as fast as possible')
+    parser.add_argument('-o', '--openmetrics', type=str,
+         help='With --replay: convert the journal to timestamped OpenMetrics in this file (for promtool backfill)')
+    parser.add_argument('--start', type=str,
+         help='With --replay: first record time, epoch seconds or ISO date/time')
+    parser.add_argument('--end', type=str,
+         help='With --replay: last record time, epoch seconds or ISO date/time')
     parser.add_argument('MPUnames', type=str, nargs='*',
          help='Provide MPU to core mappings: <Name>:<starting-MP#> <Name>:<starting-MP#> ... (enables MPU labeling)')
     
@@ -249,6 +619,10 @@ def cli():
 
 
 
+    if args.interval <= 0 or args.power_interval <= 0:
+        print('ERROR: --interval and --power-interval must be greater than 0')
+        return 20
+
     mpudict = {}
     for mpname in args.MPUnames:
         name, mpid = mpname.split(':',1)
@@ -267,10 +641,36 @@ def cli():
     REGISTRY.unregister(prometheus_client.PLATFORM_COLLECTOR)
     REGISTRY.unregister(prometheus_client.PROCESS_COLLECTOR)
 
+    try:
+        start = hitmp_journal.parse_time(args.start) if args.start else 0
+        end = hitmp_journal.parse_time(args.end) if args.end else math.inf
+    except ValueError as e:
+        print(f'ERROR: Invalid --start/--end: {e}')
+        return 20
+    if args.openmetrics:
+        if not args.replay:
+            print('ERROR: --openmetrics requires --replay <journal>')
+            return 20
+        return journal_to_openmetrics(args.replay, args.openmetrics, mpudict, start, end)
+
+    cache = CachedExposition(REGISTRY)
+    start_cached_http_server(EXPORTER_PORT, cache)
+    if args.replay:
+        print(f'Replaying journal: {" ".join(args.replay)}')
+        return replay_journal(args.replay, mpudict, cache, args.replay_speed, start, end)
+
     rmdir = os.environ.get('HITMP_RMLOCATION', args.rmdir)
     check_raid_manager(rmdir)
-    start_http_server(EXPORTER_PORT)
-    rc = mpstat_monitor(mpudict, args.interval)
+    journal = None
+    if args.journal:
+        hostname = os.environ.get('HITMP_EXPORTER_HOSTNAME', gethostname())
+        journal = hitmp_journal.JournalWriter(args.journal, hostname, args.journal_size << 20, args.journal_keep)
+        print(f'Journaling MP statistics to: {args.journal}')
+    try:
+        rc = mpstat_monitor(mpudict, args.interval, cache, args.power_interval, args.timeout, journal)
+    finally:
+        if journal:
+            journal.close()
     return rc          
 
 
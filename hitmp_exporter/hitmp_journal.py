@@ -0,0 +1,186 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Compact binary journal of the raw hitmp_exporter MP counters, fixed width records that can be memory mapped
+"""
+__author__  = "Mark Butterworth"
+__version__ = "0.1.1 20261019"
+__license__ = "MIT"
+
+# Ver 0.1.0 20261019  Initial version
+# Ver 0.1.1 20261019  Records sized by the MP count in the file header, rotating when it changes
+
+# MIT License
+
+# Copyright (c) 2023 Mark Butterworth
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import sys
+import math
+import mmap
+import struct
+
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+from array import array
+from pathlib import Path
+from datetime import datetime
+
+DEBUG = 0
+
+# File layout (little endian):
+#   header  64 bytes: magic b'HMPJ', version u16, counters u16, MPs u16, 22 pad, hostname 32s
+#   records fixed width: timestamp f64, serial 8s, watts f32 (NaN = unknown), pad u32,
+#           then u32[MPs][counters] in JOURNAL_HEADERS order, an MP with elapsed 0 is absent
+# MPs is the highest MP# + 1 of the first collection, a new file is started when it changes.
+# e.g. numpy.memmap(path, offset=64, dtype=[('t','<f8'),('serial','S8'),('watts','<f4'),('pad','<u4'),
+#                   ('mp','<u4',(MPs,9))])
+MAGIC = b'HMPJ'
+VERSION = 1
+FILE_HEADER = struct.Struct('<4sHHH22x32s')
+RECORD_HEADER = struct.Struct('<d8sf4x')
+JOURNAL_HEADERS = ['MP#', 'E-Time(us)', 'B-Time(us)', 'OT(us)', 'OI(us)', 'OE(us)', 'MT(us)', 'ME(us)', 'BE(us)', 'Sys(us)']
+COUNTERS = len(JOURNAL_HEADERS) - 1
+SUFFIX = '.hmj'
+
+###############################################################################
+
+
+class Record(NamedTuple):
+    timestamp: float
+    serialno: str
+    watts: float
+    counters: array         # u32[MPs * COUNTERS]
+
+    def stats(self) -> List[List[str]]:
+        '''Back to the raidcfg shape: [headers, row, ...] with hex counters'''
+        rows = [ JOURNAL_HEADERS ]
+        for mp in range(len(self.counters) // COUNTERS):
+            values = self.counters[mp * COUNTERS:(mp + 1) * COUNTERS]
+            if values[0]:
+                rows.append([ str(mp) ] + [ f'0x{v:08x}' for v in values ])
+        return rows
+
+
+def record_size(mps: int) -> int:
+    return RECORD_HEADER.size + mps * COUNTERS * 4
+
+
+def stats_mps(stats: List[List[str]]) -> int:
+    '''MPs needed for a collection: the highest MP# + 1'''
+    return max([ int(cols[0]) for cols in stats[1:] ], default=0) + 1
+
+
+def encode_record(timestamp: float, serialno: str, watts: Optional[float], stats: List[List[str]], mps: int) -> bytes:
+    counters = array('I', bytes(mps * COUNTERS * 4))
+    columns = [ JOURNAL_HEADERS.index(h) - 1 if h in JOURNAL_HEADERS else -1 for h in stats[0] ]
+    for cols in stats[1:]:
+        mp = int(cols[0])
+        if mp >= mps:
+            continue
+        for col, value in zip(columns[1:], cols[1:]):
+            if col >= 0:
+                counters[mp * COUNTERS + col] = int(value, 16) & 0xffffffff
+    if sys.byteorder != 'little':
+        counters.byteswap()
+    watts = math.nan if watts is None else watts
+    return RECORD_HEADER.pack(timestamp, (serialno or '').encode()[:8], watts) + counters.tobytes()
+
+
+class JournalWriter:
+    '''Append one record per MP collection, rotating to a new file at max_bytes or when
+    the MP count changes, and keeping the newest keep files (0 keeps all)
+    '''
+    def __init__(self, directory: str, hostname: str, max_bytes: int=64 << 20, keep: int=0):
+        self.directory = Path(directory)
+        self.hostname = hostname
+        self.max_bytes = max_bytes
+        self.keep = keep
+        self.fd = None
+        self.mps = 0
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _rotate(self, mps: int):
+        if self.fd:
+            self.fd.close()
+        # The sequence keeps files started within the same second unique and in order
+        name = f'hitmp-{datetime.now().strftime("%Y%m%d-%H%M%S")}'
+        n = 0
+        while (path := self.directory / f'{name}-{n:02d}{SUFFIX}').exists():
+            n += 1
+        self.fd = open(path, 'wb')
+        self.fd.write(FILE_HEADER.pack(MAGIC, VERSION, COUNTERS, mps, self.hostname.encode()[:32]))
+        self.path = path
+        self.mps = mps
+        if self.keep:
+            for old in journal_files(self.directory)[:-self.keep]:
+                old.unlink()
+
+    def append(self, timestamp: float, serialno: str, watts: Optional[float], stats: List[List[str]]):
+        mps, size = stats_mps(stats), record_size(stats_mps(stats))
+        if not self.fd or mps != self.mps or self.fd.tell() + size > max(self.max_bytes, FILE_HEADER.size + size):
+            self._rotate(mps)
+        self.fd.write(encode_record(timestamp, serialno, watts, stats, mps))
+        self.fd.flush()
+
+    def close(self):
+        if self.fd:
+            self.fd.close()
+            self.fd = None
+
+
+def journal_files(path: Path) -> List[Path]:
+    path = Path(path)
+    return sorted(path.glob('*' + SUFFIX)) if path.is_dir() else [ path ]
+
+
+def read_journal(paths: List[str], start: float=0, end: float=math.inf) -> Iterator[Tuple[str, Record]]:
+    '''Memory map the journal file(s) and yield (hostname, record) within [start, end]
+    '''
+    for path in [ f for p in paths for f in journal_files(p) ]:
+        with open(path, 'rb') as fd:
+            if os.fstat(fd.fileno()).st_size < FILE_HEADER.size:
+                continue
+            with mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                magic, version, counters, mps, hostname = FILE_HEADER.unpack_from(mm)
+                if magic != MAGIC or version != VERSION or counters != COUNTERS or not mps:
+                    print(f'WARNING: Not a version {VERSION} hitmp journal: {path}')
+                    continue
+                hostname = hostname.rstrip(b'\0').decode()
+                size = record_size(mps)
+                records = (len(mm) - FILE_HEADER.size) // size   # ignores a partly written record
+                for i in range(records):
+                    offset = FILE_HEADER.size + i * size
+                    timestamp, serialno, watts = RECORD_HEADER.unpack_from(mm, offset)
+                    if timestamp < start or timestamp > end:
+                        continue
+                    values = array('I')
+                    values.frombytes(mm[offset + RECORD_HEADER.size:offset + size])
+                    if sys.byteorder != 'little':
+                        values.byteswap()
+                    yield hostname, Record(timestamp, serialno.rstrip(b'\0').decode(), watts, values)
+
+
+def parse_time(value: str) -> float:
+    '''Epoch seconds or an ISO date/time (local time unless it has an offset)'''
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
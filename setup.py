@@ -0,0 +1,16 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Installs the shared vdb_flatfile module (used by vdb_exporter, vdb2graphite and hit2om)
+and builds its optional C accelerator, the tools still run without a compiler:
+
+    pip install -e .                          (or: uv sync)
+    python setup.py build_ext --inplace       (only build vdb_exporter/_vdb_flatfile*.so)
+"""
+from setuptools import setup, Extension
+
+setup(
+    package_dir={'': 'vdb_exporter'},
+    py_modules=['vdb_flatfile'],
+    ext_modules=[Extension('_vdb_flatfile', ['vdb_exporter/_vdb_flatfile.c'], optional=True)],
+)
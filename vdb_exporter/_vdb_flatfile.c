@@ -0,0 +1,356 @@
+/*
+ * Optional C accelerator for vdb_flatfile.FlatfileParser
+ *
+ * parse_block(data, width, first, row_type, hour_base) converts a whole buffer of
+ * flatfile interval lines in one pass, without splitting it into Python objects:
+ *
+ *   10:15:01.012 02/18/2025-10:15:01-UTC  rd1_(1)  1  10000.0  n/a ...
+ *
+ * Returns a list of row_type(timestamp, run, values) or None when the buffer is not
+ * purely interval rows, vdb_flatfile then falls back to its Python path, so both
+ * paths give the same rows. The values of all rows are converted into one block of
+ * doubles, each row gets a read-only memoryview slice of it (no float per value).
+ * Values are [-]digits[.digits] converted exactly (the mantissa / 10^decimals fast
+ * path is correctly rounded), n/a and nan are NaN and anything else goes through
+ * PyOS_string_to_double as float() does.
+ *
+ * Build in place: python setup.py build_ext --inplace (see setup.py)
+ *
+ * MIT License, Copyright (c) 2023 Mark Butterworth
+ */
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+#include <stdint.h>
+#include <string.h>
+
+#define MAX_EXACT_MANTISSA (1ULL << 53)
+#define MAX_TOKEN 64
+
+static const double POW10[] = {
+    1e0, 1e1, 1e2, 1e3, 1e4, 1e5, 1e6, 1e7, 1e8, 1e9, 1e10, 1e11,
+    1e12, 1e13, 1e14, 1e15, 1e16, 1e17, 1e18, 1e19, 1e20, 1e21, 1e22,
+};
+
+typedef struct {
+    const char *start;
+    Py_ssize_t len;
+} token_t;
+
+/* As float(token), 0 on success, -1 when the token is not a number */
+static int
+to_double(const char *s, Py_ssize_t n, double *out)
+{
+    const char *p = s, *end = s + n;
+    uint64_t mantissa = 0;
+    int negative = 0, dot = 0, digits = 0, significant = 0, decimals = 0;
+
+    if (n == 3 && (memcmp(s, "n/a", 3) == 0 || memcmp(s, "nan", 3) == 0)) {
+        *out = Py_NAN;
+        return 0;
+    }
+    if (p < end && (*p == '-' || *p == '+')) {
+        negative = *p == '-';
+        p++;
+    }
+    for (; p < end; p++) {
+        if (*p >= '0' && *p <= '9') {
+            mantissa = mantissa * 10 + (uint64_t)(*p - '0');
+            digits++;
+            if (mantissa)
+                significant++;
+            if (dot)
+                decimals++;
+            if (significant > 18)
+                break;
+        }
+        else if (*p == '.' && !dot)
+            dot = 1;
+        else
+            break;
+    }
+    if (p == end && digits && mantissa <= MAX_EXACT_MANTISSA && decimals <= 22) {
+        double value = (double)mantissa / POW10[decimals];
+        *out = negative ? -value : value;
+        return 0;
+    }
+
+    /* Exponents, inf, very long mantissas ... */
+    char buf[MAX_TOKEN + 1];
+    char *endp;
+    if (n > MAX_TOKEN)
+        return -1;
+    memcpy(buf, s, n);
+    buf[n] = '\0';
+    *out = PyOS_string_to_double(buf, &endp, NULL);
+    if (*out == -1.0 && PyErr_Occurred()) {
+        PyErr_Clear();
+        return -1;
+    }
+    return endp == buf + n ? 0 : -1;
+}
+
+/* bytes.split() whitespace */
+static char blank[256], sep[256];
+#define IS_BLANK(c) (blank[(unsigned char)(c)])
+#define IS_SEP(c) (sep[(unsigned char)(c)])
+
+/* Convert the token starting at p as float(token) does, returns the end of the token or
+ * NULL when it is not a number. [-]digits[.digits] is converted in the same pass as the
+ * scan, anything else (exponents, long mantissas ...) goes through to_double().
+ * The line ends with '\n', so no scan runs past it.
+ */
+static const char *
+scan_double(const char *p, double *out)
+{
+    const char *token = p, *digits, *dot = NULL;
+    uint64_t mantissa = 0;
+    int negative = 0;
+
+    if (*p == 'n' && p[1] == '/' && p[2] == 'a' && IS_SEP(p[3])) {
+        *out = Py_NAN;
+        return p + 3;
+    }
+    if (*p == '-') {
+        negative = 1;
+        p++;
+    }
+    digits = p;
+    while ((unsigned)(*p - '0') < 10)
+        mantissa = mantissa * 10 + (uint64_t)(*p++ - '0');
+    if (*p == '.') {
+        dot = ++p;
+        while ((unsigned)(*p - '0') < 10)
+            mantissa = mantissa * 10 + (uint64_t)(*p++ - '0');
+    }
+    Py_ssize_t ndigits = (p - digits) - (dot != NULL);
+    if (IS_SEP(*p) && ndigits > 0 && ndigits <= 19 && mantissa <= MAX_EXACT_MANTISSA) {
+        double value = (double)mantissa / POW10[dot ? p - dot : 0];
+        *out = negative ? -value : value;
+        return p;
+    }
+    while (!IS_SEP(*p))
+        p++;
+    return to_double(token, p - token, out) ? NULL : p;
+}
+
+static int
+two_digits(const char *s, long *out)
+{
+    if (s[0] < '0' || s[0] > '9' || s[1] < '0' || s[1] > '9')
+        return -1;
+    *out = (s[0] - '0') * 10 + (s[1] - '0');
+    return 0;
+}
+
+/* Same cache key as FlatfileParser._hour_base: stamp[:13] + stamp[19:] + tod[:2] */
+static int
+same_hour(const token_t *stamp, const char *tod, const token_t *last, const char *lasttod)
+{
+    return last->start && stamp->len == last->len && stamp->len >= 19
+        && memcmp(stamp->start, last->start, 13) == 0
+        && memcmp(stamp->start + 19, last->start + 19, stamp->len - 19) == 0
+        && tod[0] == lasttod[0] && tod[1] == lasttod[1];
+}
+
+static PyObject *
+parse_block(PyObject *module, PyObject *args)
+{
+    Py_buffer view;
+    Py_ssize_t width, first, columns, capacity, nrows = 0;
+    PyTypeObject *row_type;
+    PyObject *hour_base;
+    PyObject *block = NULL, *blockview = NULL, *rows = NULL, *run = NULL;
+    PyObject **runs = NULL;
+    double *stamps = NULL, *values = NULL;
+    token_t *tokens = NULL;
+    token_t laststamp = { NULL, 0 }, lastrun = { NULL, 0 };
+    const char *lasttod = NULL;
+    double base = 0.0;
+
+    if (!PyArg_ParseTuple(args, "y*nnO!O:parse_block", &view, &width, &first,
+                          &PyType_Type, &row_type, &hour_base))
+        return NULL;
+    if (width <= first || first < 3 || !PyType_IsSubtype(row_type, &PyTuple_Type)) {
+        PyErr_SetString(PyExc_ValueError, "parse_block: invalid width/first or row_type is not a tuple");
+        goto error;
+    }
+    const char *p = view.buf, *end = p + view.len;
+    if (view.len && end[-1] != '\n')
+        goto fallback;     /* a last line without '\n' (flush), the scans rely on it */
+
+    /* Rows of about the first line's length, grown as needed */
+    const char *eol = memchr(p, '\n', view.len);
+    capacity = eol ? view.len / (eol - p + 1) + 8 : 8;
+    columns = width - first;
+    tokens = PyMem_New(token_t, first + 1);
+    stamps = PyMem_New(double, capacity);
+    runs = PyMem_New(PyObject *, capacity);
+    values = PyMem_New(double, capacity * columns);
+    if (!tokens || !stamps || !runs || !values) {
+        PyErr_NoMemory();
+        goto error;
+    }
+
+    while (p < end) {
+        /* tod, timestamp and run tokens */
+        while (IS_BLANK(*p))
+            p++;
+        if (*p == '\n') {
+            p++;
+            continue;
+        }
+        for (Py_ssize_t i = 0; i <= first; i++) {
+            while (IS_BLANK(*p))
+                p++;
+            if (*p == '\n')
+                goto fallback;     /* short line */
+            tokens[i].start = p;
+            while (!IS_SEP(*p))
+                p++;
+            tokens[i].len = p - tokens[i].start;
+        }
+        p = tokens[first].start;
+
+        const token_t *tod = &tokens[0], *stamp = &tokens[1], *runtok = &tokens[2];
+        if (tod->len < 7 || tod->start[2] != ':')
+            goto fallback;
+        if (tokens[first].len >= 3 && memcmp(tokens[first].start, "avg", 3) == 0) {
+            /* run summary */
+            p = (const char *)memchr(p, '\n', end - p) + 1;
+            continue;
+        }
+
+        /* timestamp = hour_base(stamp, tod[:2]) + int(tod[3:5]) * 60 + float(tod[6:]) */
+        long minutes, hour;
+        double seconds;
+        if (two_digits(tod->start + 3, &minutes) || two_digits(tod->start, &hour)
+            || to_double(tod->start + 6, tod->len - 6, &seconds))
+            goto fallback;
+        if (!same_hour(stamp, tod->start, &laststamp, lasttod)) {
+            PyObject *result = PyObject_CallFunction(hour_base, "y#y#", stamp->start, stamp->len, tod->start, (Py_ssize_t)2);
+            if (!result) {
+                if (!PyErr_ExceptionMatches(PyExc_ValueError))
+                    goto error;
+                PyErr_Clear();
+                goto fallback;
+            }
+            base = PyFloat_AsDouble(result);
+            Py_DECREF(result);
+            if (base == -1.0 && PyErr_Occurred())
+                goto error;
+            laststamp = *stamp;
+            lasttod = tod->start;
+        }
+
+        if (!run || runtok->len != lastrun.len || memcmp(runtok->start, lastrun.start, runtok->len)) {
+            Py_XDECREF(run);
+            run = PyUnicode_DecodeUTF8(runtok->start, runtok->len, "replace");
+            if (!run)
+                goto error;
+            lastrun = *runtok;
+        }
+
+        if (nrows == capacity) {
+            /* Keep the old buffers when a realloc fails, they are freed below */
+            capacity *= 2;
+            double *more_stamps = PyMem_Realloc(stamps, capacity * sizeof(double));
+            if (more_stamps)
+                stamps = more_stamps;
+            PyObject **more_runs = more_stamps ? PyMem_Realloc(runs, capacity * sizeof(PyObject *)) : NULL;
+            if (more_runs)
+                runs = more_runs;
+            double *more_values = more_runs ? PyMem_Realloc(values, capacity * columns * sizeof(double)) : NULL;
+            if (!more_values) {
+                PyErr_NoMemory();
+                goto error;
+            }
+            values = more_values;
+        }
+
+        /* Exactly columns values to the end of the line */
+        double *row = values + nrows * columns;
+        for (Py_ssize_t i = 0; i < columns; i++) {
+            while (IS_BLANK(*p))
+                p++;
+            if (*p == '\n' || !(p = scan_double(p, &row[i])))
+                goto fallback;
+        }
+        while (IS_BLANK(*p))
+            p++;
+        if (*p++ != '\n')
+            goto fallback;     /* long line */
+
+        stamps[nrows] = base + (double)(minutes * 60) + seconds;
+        Py_INCREF(run);
+        runs[nrows++] = run;
+    }
+
+    /* rows[n] = row_type(stamps[n], runs[n], blockview[n*columns:(n+1)*columns]) */
+    block = PyBytes_FromStringAndSize((const char *)values, nrows * columns * (Py_ssize_t)sizeof(double));
+    if (!block)
+        goto error;
+    PyObject *bytesview = PyMemoryView_FromObject(block);
+    if (!bytesview)
+        goto error;
+    blockview = PyObject_CallMethod(bytesview, "cast", "s", "d");
+    Py_DECREF(bytesview);
+    if (!blockview || !(rows = PyList_New(nrows)))
+        goto error;
+    for (Py_ssize_t n = 0; n < nrows; n++) {
+        PyObject *row = row_type->tp_alloc(row_type, 3);
+        PyObject *ts = PyFloat_FromDouble(stamps[n]);
+        PyObject *slice = PySequence_GetSlice(blockview, n * columns, (n + 1) * columns);
+        if (!row || !ts || !slice) {
+            Py_XDECREF(row);
+            Py_XDECREF(ts);
+            Py_XDECREF(slice);
+            goto error;
+        }
+        PyTuple_SET_ITEM(row, 0, ts);
+        PyTuple_SET_ITEM(row, 1, runs[n]);
+        PyTuple_SET_ITEM(row, 2, slice);
+        runs[n] = NULL;     /* reference moved to the row */
+        PyList_SET_ITEM(rows, n, row);
+    }
+    goto done;
+
+fallback:
+    rows = Py_None;
+    Py_INCREF(rows);
+    goto done;
+
+error:
+    Py_CLEAR(rows);
+
+done:
+    for (Py_ssize_t n = 0; n < nrows; n++)
+        Py_XDECREF(runs[n]);
+    Py_XDECREF(run);
+    Py_XDECREF(blockview);
+    Py_XDECREF(block);
+    PyMem_Free(values);
+    PyMem_Free(runs);
+    PyMem_Free(stamps);
+    PyMem_Free(tokens);
+    PyBuffer_Release(&view);
+    return rows;
+}
+
+static PyMethodDef methods[] = {
+    {"parse_block", parse_block, METH_VARARGS,
+     "parse_block(data, width, first, row_type, hour_base) -> list of rows, or None to use the Python path"},
+    {NULL, NULL, 0, NULL}
+};
+
+static struct PyModuleDef module = {
+    PyModuleDef_HEAD_INIT, "_vdb_flatfile", "C accelerator for vdb_flatfile", -1, methods
+};
+
+PyMODINIT_FUNC
+PyInit__vdb_flatfile(void)
+{
+    for (const char *c = " \t\r\v\f"; *c; c++)
+        blank[(unsigned char)*c] = sep[(unsigned char)*c] = 1;
+    sep['\n'] = 1;
+    return PyModule_Create(&module);
+}
@@ -0,0 +1,383 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Prometheus remote-write client (snappy compressed protobuf) using only the standard library
+"""
+__author__  = "Mark Butterworth"
+__version__ = "0.1.1 20261019"
+__license__ = "MIT"
+
+# Ver 0.1.0 20261019  Initial version
+# Ver 0.1.1 20261019  Only the sender thread closes the connection, close() just stops it
+
+# MIT License
+
+# Copyright (c) 2023 Mark Butterworth
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import time
+import struct
+import threading
+import http.client
+
+from typing import Dict, List, Tuple, Optional
+from collections import deque
+from urllib.parse import urlsplit
+
+try:
+    import snappy   # python-snappy is optional, a pure python codec is used otherwise
+except ImportError:
+    snappy = None
+
+DEBUG = 0
+
+REMOTE_WRITE_HEADERS = {
+    'Content-Type': 'application/x-protobuf',
+    'Content-Encoding': 'snappy',
+    'User-Agent': 'vdb_exporter',
+    'X-Prometheus-Remote-Write-Version': '0.1.0',
+}
+
+# (labels sorted by name including __name__, [(timestamp_ms, value), ...])
+Series = Tuple[Tuple[Tuple[str, str], ...], List[Tuple[int, float]]]
+
+###############################################################################
+# Protobuf encoding of prometheus.WriteRequest:
+#   WriteRequest { repeated TimeSeries timeseries = 1; }
+#   TimeSeries   { repeated Label labels = 1; repeated Sample samples = 2; }
+#   Label        { string name = 1; string value = 2; }
+#   Sample       { double value = 1; int64 timestamp = 2; }
+
+
+def _varint(value: int) -> bytes:
+    value &= 0xFFFFFFFFFFFFFFFF    # int64 negatives are encoded as 10 byte varints
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _read_varint(data: bytes, pos: int) -> Tuple[int, int]:
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+def _len_field(field: int, payload: bytes) -> bytes:
+    return _varint(field << 3 | 2) + _varint(len(payload)) + payload
+
+
+def encode_write_request(series: List[Series]) -> bytes:
+    out = bytearray()
+    for labels, samples in series:
+        ts = bytearray()
+        for name, value in labels:
+            ts += _len_field(1, _len_field(1, name.encode()) + _len_field(2, value.encode()))
+        for timestamp, value in samples:
+            ts += _len_field(2, b'\x09' + struct.pack('<d', value) + b'\x10' + _varint(timestamp))
+        out += _len_field(1, bytes(ts))
+    return bytes(out)
+
+
+def _fields(data: bytes):
+    '''generator yielding (field number, wire type, value) from a protobuf message
+    '''
+    pos = 0
+    while pos < len(data):
+        key, pos = _read_varint(data, pos)
+        field, wire = key >> 3, key & 7
+        if wire == 0:
+            value, pos = _read_varint(data, pos)
+        elif wire == 1:
+            value, pos = data[pos:pos+8], pos+8
+        elif wire == 2:
+            size, pos = _read_varint(data, pos)
+            value, pos = data[pos:pos+size], pos+size
+        elif wire == 5:
+            value, pos = data[pos:pos+4], pos+4
+        else:
+            raise ValueError(f'Unsupported protobuf wire type: {wire}')
+        yield field, wire, value
+
+
+def decode_write_request(data: bytes) -> List[Series]:
+    '''Decode an uncompressed WriteRequest, e.g. for a stub receiver
+    '''
+    series = []
+    for field, _, tsdata in _fields(data):
+        if field != 1:
+            continue
+        labels, samples = [], []
+        for tsfield, _, value in _fields(tsdata):
+            if tsfield == 1:
+                label = { f: v.decode() for f, _, v in _fields(value) }
+                labels.append((label.get(1, ''), label.get(2, '')))
+            elif tsfield == 2:
+                sample = { f: v for f, _, v in _fields(value) }
+                timestamp = sample.get(2, 0)
+                if timestamp >= 1 << 63:
+                    timestamp -= 1 << 64
+                samples.append((timestamp, struct.unpack('<d', sample.get(1, bytes(8)))[0]))
+        series.append((tuple(labels), samples))
+    return series
+
+
+###############################################################################
+# Snappy block format (https://github.com/google/snappy/blob/main/format_description.txt)
+
+
+def _snappy_literal(out: bytearray, data: bytes, start: int, end: int):
+    size = end - start
+    if size <= 0:
+        return
+    if size <= 60:
+        out.append((size-1) << 2)
+    else:
+        nbytes = ((size-1).bit_length() + 7) // 8
+        out.append((59+nbytes) << 2)
+        out += (size-1).to_bytes(nbytes, 'little')
+    out += data[start:end]
+
+
+def _snappy_copy(out: bytearray, offset: int, size: int):
+    while size > 0:
+        chunk = min(size, 64)
+        out.append((chunk-1) << 2 | 2)
+        out += offset.to_bytes(2, 'little')
+        size -= chunk
+
+
+def snappy_compress(data: bytes) -> bytes:
+    if snappy:
+        return snappy.compress(data)
+    out = bytearray(_varint(len(data)))
+    table = {}
+    literal = pos = 0
+    end = len(data)
+    while pos + 4 <= end:
+        key = data[pos:pos+4]
+        candidate = table.get(key)
+        table[key] = pos
+        if candidate is None or pos - candidate > 0xFFFF:
+            pos += 1
+            continue
+        size = 4
+        while pos+size < end and data[candidate+size] == data[pos+size]:
+            size += 1
+        _snappy_literal(out, data, literal, pos)
+        _snappy_copy(out, pos-candidate, size)
+        pos += size
+        literal = pos
+    _snappy_literal(out, data, literal, end)
+    return bytes(out)
+
+
+def snappy_decompress(data: bytes) -> bytes:
+    if snappy:
+        return snappy.decompress(data)
+    length, pos = _read_varint(data, 0)
+    out = bytearray()
+    while pos < len(data):
+        tag = data[pos]
+        pos += 1
+        kind = tag & 3
+        if kind == 0:
+            size = tag >> 2
+            if size >= 60:
+                nbytes = size - 59
+                size = int.from_bytes(data[pos:pos+nbytes], 'little')
+                pos += nbytes
+            size += 1
+            out += data[pos:pos+size]
+            pos += size
+            continue
+        if kind == 1:
+            size = ((tag >> 2) & 7) + 4
+            offset = (tag >> 5) << 8 | data[pos]
+            pos += 1
+        elif kind == 2:
+            size = (tag >> 2) + 1
+            offset = int.from_bytes(data[pos:pos+2], 'little')
+            pos += 2
+        else:
+            size = (tag >> 2) + 1
+            offset = int.from_bytes(data[pos:pos+4], 'little')
+            pos += 4
+        if offset == 0 or offset > len(out):
+            raise ValueError(f'Invalid snappy copy offset: {offset}')
+        start = len(out) - offset
+        if offset >= size:
+            out += out[start:start+size]
+        else:
+            for i in range(size):   # Overlapping copy repeats the pattern
+                out.append(out[start+i])
+    if len(out) != length:
+        raise ValueError(f'Snappy length mismatch: {len(out)} != {length}')
+    return bytes(out)
+
+
+###############################################################################
+
+
+class RemoteWriter:
+    '''Queue samples and push them in batches to a Prometheus remote-write endpoint.
+
+    Samples are held in a bounded in-memory queue and sent by a background thread
+    when either batch_size samples are waiting or batch_interval seconds have passed.
+    The HTTP connection is kept alive between batches, failed sends are retried with
+    exponential backoff and samples that cannot be queued or sent are counted as dropped.
+    '''
+    def __init__(self, url: str, batch_size: int=2000, batch_interval: float=1.0,
+                 max_queue: int=100000, timeout: float=10.0, max_retries: int=5,
+                 backoff: float=0.5, max_backoff: float=30.0, headers: Optional[Dict]=None):
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https') or not parts.hostname:
+            raise ValueError(f'Invalid remote-write URL: {url}')
+        self.url = url
+        self._scheme = parts.scheme
+        self._host = parts.hostname
+        self._port = parts.port
+        self._path = parts.path or '/'
+        if parts.query:
+            self._path += '?' + parts.query
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.headers = dict(REMOTE_WRITE_HEADERS, **(headers or {}))
+
+        self.sent = 0
+        self.dropped = 0
+        self.failed_requests = 0
+        self._reported_dropped = 0
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._closing = False
+        self._conn = None
+        self._thread = threading.Thread(target=self._run, name='remote_write', daemon=True)
+        self._thread.start()
+
+    def append(self, name: str, labels: Dict[str, str], value: float, timestamp_ms: int) -> bool:
+        key = tuple(sorted(dict(labels, __name__=name).items()))
+        with self._cond:
+            if len(self._queue) >= self.max_queue:
+                self.dropped += 1
+                return False
+            self._queue.append((key, timestamp_ms, float(value)))
+            if len(self._queue) >= self.batch_size:
+                self._cond.notify()
+        return True
+
+    def stats(self) -> Dict[str, int]:
+        with self._cond:
+            queued = len(self._queue)
+        return { 'sent': self.sent, 'dropped': self.dropped,
+                 'failed_requests': self.failed_requests, 'queued': queued }
+
+    def close(self, timeout: float=10.0):
+        '''Flush what is queued (within timeout) and stop the sender thread.
+        The connection belongs to the sender thread, it is closed there as the thread exits.
+        '''
+        with self._cond:
+            self._closing = True
+            self._cond.notify()
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            print(f'\nWARNING: remote-write still sending after {timeout}sec, '
+                  f'{self.stats()["queued"]} samples queued to: {self.url}')
+
+    def _run(self):
+        try:
+            while True:
+                with self._cond:
+                    deadline = time.monotonic() + self.batch_interval
+                    while len(self._queue) < self.batch_size and not self._closing:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._cond.wait(remaining)
+                    batch = [ self._queue.popleft() for _ in range(min(len(self._queue), self.batch_size)) ]
+                    if not batch and self._closing:
+                        return
+                if batch:
+                    self._send(batch)
+                if self.dropped > self._reported_dropped:
+                    print(f'\nWARNING: remote-write dropped {self.dropped - self._reported_dropped} samples '
+                          f'(total {self.dropped}) to: {self.url}')
+                    self._reported_dropped = self.dropped
+        finally:
+            self._disconnect()
+
+    def _disconnect(self):
+        # Sender thread only
+        if self._conn:
+            self._conn.close()
+            self._conn = None
+
+    def _send(self, batch: List[Tuple]):
+        grouped = {}
+        for key, timestamp, value in batch:
+            grouped.setdefault(key, []).append((timestamp, value))
+        series = [ (key, sorted(samples)) for key, samples in grouped.items() ]
+        payload = snappy_compress(encode_write_request(series))
+
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                delay = min(self.max_backoff, self.backoff * 2 ** (attempt-1))
+                with self._cond:
+                    if not self._closing:
+                        self._cond.wait(delay)
+            try:
+                status, reason = self._post(payload)
+            except (OSError, http.client.HTTPException) as e:
+                status, reason = 0, str(e)
+                self._disconnect()
+            if 200 <= status < 300:
+                self.sent += len(batch)
+                return
+            self.failed_requests += 1
+            if DEBUG:
+                print(f'remote-write attempt {attempt+1} failed: {status} {reason}')
+            if 400 <= status < 500 and status != 429:
+                break    # Not recoverable, e.g. out of order samples
+        print(f'\nWARNING: remote-write failed to send {len(batch)} samples: {status} {reason}')
+        with self._cond:
+            self.dropped += len(batch)
+
+    def _post(self, payload: bytes) -> Tuple[int, str]:
+        if not self._conn:
+            conntype = http.client.HTTPSConnection if self._scheme == 'https' else http.client.HTTPConnection
+            self._conn = conntype(self._host, self._port, timeout=self.timeout)
+        self._conn.request('POST', self._path, body=payload, headers=self.headers)
+        response = self._conn.getresponse()
+        body = response.read()   # Must drain the response to reuse the connection
+        if response.will_close:
+            self._disconnect()
+        return response.status, body.decode(errors='replace').strip() or response.reason
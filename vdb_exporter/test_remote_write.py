@@ -0,0 +1,192 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for remote_write: WriteRequests round-tripped through a stub HTTP receiver
+    cd vdb_exporter && python -m unittest test_remote_write
+"""
+__author__  = "Mark Butterworth"
+__version__ = "0.1.0 20261019"
+__license__ = "MIT"
+
+# Ver 0.1.0 20261019  Initial version
+
+# MIT License, Copyright (c) 2023 Mark Butterworth, see LICENSE
+
+import time
+import threading
+import unittest
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import remote_write
+from remote_write import RemoteWriter, decode_write_request, encode_write_request, snappy_compress, snappy_decompress
+
+
+class StubReceiver(ThreadingHTTPServer):
+    '''Remote-write endpoint that decodes every request, replies with the queued statuses then 204
+    '''
+    daemon_threads = True
+
+    def __init__(self, statuses=()):
+        super().__init__(('127.0.0.1', 0), StubHandler)
+        self.statuses = list(statuses)
+        self.delay = 0.0
+        self.requests = []      # (headers, [Series, ...])
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.server_address[1]}/api/v1/write'
+
+    def samples(self):
+        return [ (dict(labels), sample) for _, series in self.requests
+                 for labels, samples in series for sample in samples ]
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'      # Keep-alive, as RemoteWriter expects
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        time.sleep(self.server.delay)
+        self.server.requests.append((dict(self.headers), decode_write_request(snappy_decompress(body))))
+        status = self.server.statuses.pop(0) if self.server.statuses else 204
+        reply = b'' if status == 204 else b'stub error'
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(reply)))
+        self.end_headers()
+        self.wfile.write(reply)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestEncoding(unittest.TestCase):
+    def test_write_request_bytes(self):
+        # WriteRequest{ timeseries: [{ labels: [{__name__, up}], samples: [{1.0, 1000}] }] }
+        expected = bytes.fromhex('0a1e'                                 # timeseries, 30 bytes
+                                 '0a0e' '0a085f5f6e616d655f5f' '12027570'  # label __name__=up
+                                 '120c' '09000000000000f03f' '10e807')     # sample 1.0 @ 1000
+        data = encode_write_request([((('__name__', 'up'),), [(1000, 1.0)])])
+        self.assertEqual(data, expected)
+        self.assertEqual(decode_write_request(data), [((('__name__', 'up'),), [(1000, 1.0)])])
+
+    def test_negative_timestamp(self):
+        series = [((('__name__', 'x'),), [(-5, -2.5)])]
+        self.assertEqual(decode_write_request(encode_write_request(series)), series)
+
+    def test_snappy_round_trip(self):
+        for data in (b'', b'abc', bytes(range(256)) * 40, b'vdbench_rate' * 5000 + b'tail'):
+            self.assertEqual(snappy_decompress(snappy_compress(data)), data)
+
+    def test_pure_python_snappy(self):
+        saved, remote_write.snappy = remote_write.snappy, None
+        try:
+            data = b'vdbench_resp{host="h1"}' * 300
+            compressed = snappy_compress(data)
+            self.assertLess(len(compressed), len(data) // 10)
+            self.assertEqual(snappy_decompress(compressed), data)
+        finally:
+            remote_write.snappy = saved
+
+
+class TestRemoteWriter(unittest.TestCase):
+    def setUp(self):
+        self.receiver = StubReceiver()
+
+    def tearDown(self):
+        self.receiver.stop()
+
+    def writer(self, **kwargs) -> RemoteWriter:
+        kwargs = dict(dict(batch_size=100, batch_interval=0.05, backoff=0.01), **kwargs)
+        return RemoteWriter(self.receiver.url, **kwargs)
+
+    def test_round_trip(self):
+        writer = self.writer(batch_size=4)
+        for i in range(10):
+            writer.append('vdbench_rate', {'host': 'h1', 'run': 'rd1'}, 1000.0 + i, 1739873700000 + i * 1000)
+        writer.append('vdbench_resp', {'host': 'h1'}, float('inf'), 1739873700000)
+        writer.close()
+
+        headers = self.receiver.requests[0][0]
+        self.assertEqual(headers['Content-Encoding'], 'snappy')
+        self.assertEqual(headers['Content-Type'], 'application/x-protobuf')
+        self.assertEqual(headers['X-Prometheus-Remote-Write-Version'], '0.1.0')
+        self.assertGreaterEqual(len(self.receiver.requests), 3)     # batches of 4
+        samples = self.receiver.samples()
+        self.assertEqual(len(samples), 11)
+        rate = [ sample for labels, sample in samples if labels['__name__'] == 'vdbench_rate' ]
+        self.assertEqual(rate, [ (1739873700000 + i * 1000, 1000.0 + i) for i in range(10) ])
+        self.assertIn(({'__name__': 'vdbench_resp', 'host': 'h1'}, (1739873700000, float('inf'))), samples)
+        # Labels are sent sorted by name, as remote-write requires
+        for _, series in self.receiver.requests:
+            for labels, _ in series:
+                self.assertEqual(list(labels), sorted(labels))
+        self.assertEqual(writer.stats(), { 'sent': 11, 'dropped': 0, 'failed_requests': 0, 'queued': 0 })
+
+    def test_retry_then_sent(self):
+        self.receiver.statuses = [ 500, 503 ]
+        writer = self.writer()
+        writer.append('vdbench_rate', {}, 1.0, 1000)
+        writer.close()
+        self.assertEqual(len(self.receiver.requests), 3)
+        self.assertEqual(writer.stats()['sent'], 1)
+        self.assertEqual(writer.stats()['failed_requests'], 2)
+
+    def test_client_error_not_retried(self):
+        self.receiver.statuses = [ 400 ]
+        writer = self.writer()
+        writer.append('vdbench_rate', {}, 1.0, 1000)
+        writer.close()
+        self.assertEqual(len(self.receiver.requests), 1)
+        self.assertEqual(writer.stats(), { 'sent': 0, 'dropped': 1, 'failed_requests': 1, 'queued': 0 })
+
+    def test_queue_full_drops(self):
+        writer = self.writer(max_queue=5, batch_size=1000, batch_interval=60)
+        results = [ writer.append('vdbench_rate', {}, float(i), 1000 + i) for i in range(8) ]
+        self.assertEqual(results, [True] * 5 + [False] * 3)
+        writer.close()
+        self.assertEqual(writer.stats()['sent'], 5)
+        self.assertEqual(writer.stats()['dropped'], 3)
+
+    def test_close_stops_sender_and_connection(self):
+        writer = self.writer()
+        writer.append('vdbench_rate', {}, 1.0, 1000)
+        writer.close()
+        self.assertFalse(writer._thread.is_alive())
+        self.assertIsNone(writer._conn)      # closed by the sender thread as it exited
+
+    def test_close_timeout_leaves_connection_to_sender(self):
+        self.receiver.delay = 0.5
+        writer = self.writer()
+        writer.append('vdbench_rate', {}, 1.0, 1000)
+        time.sleep(0.2)             # the batch is being posted
+        writer.close(timeout=0.05)
+        self.assertTrue(writer._thread.is_alive())
+        self.assertIsNotNone(writer._conn)      # not closed under the sender
+        writer._thread.join(5)      # the in-flight post completes on its own connection
+        self.assertFalse(writer._thread.is_alive())
+        self.assertEqual(writer.stats()['sent'], 1)
+        self.assertIsNone(writer._conn)
+
+    def test_unreachable_endpoint(self):
+        self.receiver.stop()
+        writer = RemoteWriter(self.receiver.url, batch_interval=0.01, max_retries=1, backoff=0.01)
+        writer.append('vdbench_rate', {}, 1.0, 1000)
+        writer.close()
+        self.assertEqual(writer.stats()['dropped'], 1)
+        self.assertIsNone(writer._conn)
+        self.receiver = StubReceiver()      # for tearDown
+
+    def test_invalid_url(self):
+        with self.assertRaises(ValueError):
+            RemoteWriter('ftp://example/write')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,10 +4,13 @@
 Monitor vdbench and post to Graphite timeseries database
 """
 __author__  = "Mark Butterworth"
-__version__ = "0.1.0 20250217"
+__version__ = "0.3.1 20261019"
 __license__ = "MIT"
 
 # Ver 0.1.0 20250217  Initial version
+# Ver 0.2.0 20261019  Offline bulk import of completed flatfiles direct to Whisper files (--whisper)
+# Ver 0.3.0 20261019  Shared bytes flatfile parser (vdb_flatfile), only metric columns are sent
+# Ver 0.3.1 20261019  --whisper reports only the metrics actually written
 
 # MIT License
 
@@ -39,18 +42,22 @@ import os.path
 import time
 import pickle
 import struct
-from typing import Tuple, Optional, Union, TextIO
+import math
+from typing import Tuple, Optional, Union, TextIO, List
 from pathlib import Path
 from datetime import datetime
 
+import whisper_writer
+from vdb_flatfile import FlatfileParser, follow_rows, read_flatfile
+
 DEBUG = 0
 VERBOSE = 0
 FORCE = False
 
 ROOTPATH='vdbench'
-DATETIME_FORMAT = r'%m/%d/%Y-%H:%M:%S-%Z'
 CARBON_SERVER = '127.0.0.1'
 CARBON_PICKLE_PORT = 2004
+GRAPHITE_CONFIG = Path(__file__).resolve().parent.parent / 'graphite_config'
 
 ###############################################################################
 
@@ -83,22 +90,6 @@ def find_vdb_outputdir() -> Tuple[int, Union[Path, None]]:
     return proc.pid, workdir
 
 
-def follow(fd: TextIO , timeout: int=60):
-    '''generator function that yields new lines in a file
-    '''
-    start = time.perf_counter()
-    while True:
-        line = fd.readline()
-        if not line:
-            if timeout and time.perf_counter() >= start+timeout:
-                break
-            time.sleep(0.1)
-            continue
-        yield line
-        start = time.perf_counter()
-    print(f'WARNING: Timeout following: {fd.name}')
-
-
 def process_flatfile(result_dir: str, sock, pathroot: Optional[str]=None, tags: Optional[dict]=None):
     flatfile = Path(result_dir) / 'flatfile.html'
 
@@ -107,36 +98,63 @@ def process_flatfile(result_dir: str, sock, pathroot: Optional[str]=None, tags:
 
     if tags:
         tagstr = ';'.join([ f'{k}={v}' for k,v in tags.items() ])
-    
-    header = None
-    with open(flatfile, 'r') as fd:
-        for line in follow(fd, 15):
-            line = line.strip()
-            if 'tod' in line:
-                header = line.split()
-                header = [ x.lower().replace('/', '_') for x in header ]
-                print('Header:', header)
-                continue
-            if header:
-                values = line.split()
-                timestamp = int(datetime.strptime(values[1], DATETIME_FORMAT).timestamp())
-                metrics = []
-                for i, col in enumerate(values[2:]):
-                    pathname = pathroot + '.' + header[i+2] if pathroot else header[i+2]
-                    # if tags: # For some reason tags are not working!
-                    #     pathname += ';' + tagstr
-                    col.replace('/', '')
-                    metrics.append(graphite_metric(pathname, col, timestamp))
-                print('.', end='')
-                print(metrics)
-                payload = pickle.dumps(metrics, protocol=2)
-                size = struct.pack("!L", len(payload))
-                sock.sendall(size)
-                sock.sendall(payload)
-                # The plaintext protocol:
-                # for metric in metrics:
-                #     print (metric)
-                #     sock.sendall(f'{metric[0]} {metric[1][1]} {metric[1][0]}'.encode())
+
+    pathnames = None
+    parser = FlatfileParser()
+    with open(flatfile, 'rb') as fd:
+        for row in follow_rows(fd, parser, 15, 15):
+            if pathnames is None:
+                print('Header:', parser.header.names)
+                pathnames = [ pathroot + '.' + col if pathroot else col for col in parser.header.columns ]
+            timestamp = int(row.timestamp)
+            metrics = []
+            for pathname, val in zip(pathnames, row.values):
+                # if tags: # For some reason tags are not working!
+                #     pathname += ';' + tagstr
+                if not math.isnan(val):    # n/a
+                    metrics.append(graphite_metric(pathname, val, timestamp))
+            print('.', end='')
+            print(metrics)
+            payload = pickle.dumps(metrics, protocol=2)
+            size = struct.pack("!L", len(payload))
+            sock.sendall(size)
+            sock.sendall(payload)
+            # The plaintext protocol:
+            # for metric in metrics:
+            #     print (metric)
+            #     sock.sendall(f'{metric[0]} {metric[1][1]} {metric[1][0]}'.encode())
+
+
+def import_flatfiles(flatfiles: List[str], storagedir: str, confdir: str, pathroot: str) -> int:
+    '''Offline bulk import writing whole Whisper files rather than streaming through carbon
+    '''
+    rules = whisper_writer.StorageRules(Path(confdir))
+    series = {}
+    for flatfile in flatfiles:
+        header, rows = read_flatfile(Path(flatfile))
+        if not header:
+            print(f'ERROR: Header not found in flatfile: {flatfile}')
+            return 20
+        print(f'Read {len(rows)} intervals from: {flatfile}')
+        for row in rows:
+            for col, val in zip(header.columns, row.values):
+                if not math.isnan(val):    # n/a values are left as gaps
+                    series.setdefault(pathroot + '.' + col, {})[int(row.timestamp)] = val
+
+    written, metrics, skipped = 0, 0, 0
+    for metric, points in series.items():
+        path = whisper_writer.whisper_path(storagedir, metric)
+        if path.exists() and not FORCE:
+            print(f'WARNING: Skipping existing (use --force to overwrite): {path}')
+            skipped += 1
+            continue
+        written += whisper_writer.write_whisper(path, points, rules, metric)
+        metrics += 1
+        if VERBOSE:
+            print(f'{metric}: {len(points)} points -> {path}')
+    print(f'Wrote {metrics} metrics ({written/1024/1024:.1f} MiB) to: {storagedir}'
+          + (f', skipped {skipped} existing' if skipped else ''))
+    return 0
 
 
 def cli():
@@ -148,7 +166,15 @@ def cli():
     parser.add_argument('-v', '--verbose', action='count',
         help='Increase verbose level, e.g. -vv = level 2.')
     parser.add_argument('-f', '--force', action='store_true',
-         help='Force')
+         help='Force, e.g. overwrite existing Whisper files')
+    parser.add_argument('-w', '--whisper', type=str,
+         help='Offline import: write the flatfiles direct to this Whisper storage directory')
+    parser.add_argument('-c', '--confdir', type=str, default=str(GRAPHITE_CONFIG),
+         help=f'Carbon config directory with {whisper_writer.SCHEMAS_FILE} and {whisper_writer.AGGREGATION_FILE}')
+    parser.add_argument('-r', '--root', type=str, default=get_root_path(),
+         help='Graphite metric path root')
+    parser.add_argument('flatfiles', type=str, nargs='*',
+         help='Completed vdbench flatfile.html files to import (with --whisper)')
 
     args = parser.parse_args()
     global DEBUG, VERBOSE, FORCE
@@ -163,6 +189,13 @@ def cli():
         return 10
 
     VERBOSE = args.verbose
+    FORCE = args.force
+
+    if args.whisper:
+        if not args.flatfiles:
+            print('ERROR: --whisper requires one or more flatfiles')
+            return 20
+        return import_flatfiles(args.flatfiles, args.whisper, args.confdir, args.root)
 
     rc=0
     vdb_pid, vdb_output = find_vdb_outputdir()
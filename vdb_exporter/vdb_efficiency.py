@@ -0,0 +1,244 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Correlate Vdbench throughput with hitmp_exporter MP busy and power to publish efficiency metrics
+"""
+__author__  = "Mark Butterworth"
+__version__ = "0.1.1 20261019"
+__license__ = "MIT"
+
+# Ver 0.1.0 20261019  Initial version
+# Ver 0.1.1 20261019  Busy % from per MP deltas of the wrapping 32 bit counters
+
+# MIT License
+
+# Copyright (c) 2023 Mark Butterworth
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import math
+import time
+import threading
+import urllib.request
+import urllib.error
+
+from typing import Dict, List, Tuple, Optional
+from collections import deque
+from email.utils import parsedate_to_datetime
+
+from prometheus_client import CollectorRegistry, Gauge
+from prometheus_client.parser import text_string_to_metric_families
+
+DEBUG = 0
+
+METRIC_PREFIX = 'vdbench_'
+HITMP_PREFIX = 'hitmp_'
+BUSY_MODE = 'Busy_Time'
+COUNTER_WRAP = 1 << 32     # raidcfg counters are 32 bit (us)
+RESET_SLACK = 2            # elapsed us may exceed the wall clock by this factor
+
+# Derived series: name -> (numerator, denominator, help)
+EFFICIENCY_METRICS = {
+    'iops_per_busy_pct': ('rate', 'busy_pct', 'IO/s per % of average MP busy'),
+    'mbps_per_busy_pct': ('mb_sec', 'busy_pct', 'MB/s per % of average MP busy'),
+    'iops_per_watt': ('rate', 'watts', 'IO/s per storage Watt'),
+    'mbps_per_watt': ('mb_sec', 'watts', 'MB/s per storage Watt'),
+}
+
+###############################################################################
+
+
+def hitmp_sample(text: str) -> Tuple[Dict[Tuple[str, str], Tuple[float, float]], float]:
+    '''Per MP (serialno, MPid) raw (elapsed, busy) counters and total Watts from a hitmp exposition
+    '''
+    counters, watts = {}, 0.0
+    for family in text_string_to_metric_families(text):
+        for sample in family.samples:
+            mp = (sample.labels.get('serialno', ''), sample.labels.get('MPid', ''))
+            if sample.name == HITMP_PREFIX + 'elapsed_total':
+                counters[mp] = (sample.value, counters.get(mp, (0.0, 0.0))[1])
+            elif sample.name == HITMP_PREFIX + 'coretime_total' and sample.labels.get('mode') == BUSY_MODE:
+                counters[mp] = (counters.get(mp, (0.0, 0.0))[0], sample.value)
+            elif sample.name == HITMP_PREFIX + 'power_watts':
+                watts += sample.value
+    # An MP without a Busy_Time sample had a zero counter (hitmp_exporter skips zeros)
+    return { mp: c for mp, c in counters.items() if c[0] }, (watts or math.nan)
+
+
+def busy_pct(previous: Dict[Tuple[str, str], Tuple[float, float]], current: Dict[Tuple[str, str], Tuple[float, float]],
+             seconds: float) -> float:
+    '''Average MP busy % between two samples of the 32 bit wrapping raidcfg counters:
+    sum(delta busy) / sum(delta elapsed) over the MPs in both. NaN when there is no
+    previous sample or the counters look reset (elapsed moved on more than the wall
+    clock allows, or busy more than elapsed).
+    '''
+    if not previous or seconds <= 0:
+        return math.nan
+    elapsed, busy = 0, 0
+    for mp, (e, b) in current.items():
+        if mp not in previous:
+            continue
+        de = (int(e) - int(previous[mp][0])) % COUNTER_WRAP
+        db = (int(b) - int(previous[mp][1])) % COUNTER_WRAP
+        if de == 0 or de > seconds * 1e6 * RESET_SLACK or db > de:
+            return math.nan
+        elapsed += de
+        busy += db
+    return 100 * busy / elapsed if elapsed else math.nan
+
+
+class HitmpSource:
+    '''Poll a hitmp_exporter /metrics and keep recent (time, busy %, watts) samples.
+
+    The exporter's ETag shows whether a new raidcfg cycle has completed and its
+    Last-Modified header is used as the sample time, so unchanged scrapes are ignored.
+    '''
+    def __init__(self, url: str, poll: float=5.0, keep: int=720, timeout: float=10.0):
+        self.url = url
+        self.poll = poll
+        self.timeout = timeout
+        self.samples = deque(maxlen=keep)
+        self._lock = threading.Lock()
+        self._etag = None
+        self._previous = ({}, 0.0)     # (per MP counters, time) of the last sample
+        self._thread = threading.Thread(target=self._run, name='hitmp_source', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self._fetch()
+            except (OSError, ValueError) as e:
+                if DEBUG:
+                    print(f'\nWARNING: Cannot read {self.url}: {e}')
+            time.sleep(self.poll)
+
+    def _fetch(self):
+        request = urllib.request.Request(self.url)
+        if self._etag:
+            request.add_header('If-None-Match', self._etag)
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                text = response.read().decode()
+                etag = response.headers.get('ETag')
+                lastmod = response.headers.get('Last-Modified')
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                return
+            raise
+        if etag and etag == self._etag:
+            return
+        self._etag = etag
+        stamp = parsedate_to_datetime(lastmod).timestamp() if lastmod else time.time()
+        counters, watts = hitmp_sample(text)
+        if counters and counters == self._previous[0]:
+            # Only the power (or source ages) changed, keep the busy % of the last MP cycle
+            with self._lock:
+                busy = self.samples[-1][1] if self.samples else math.nan
+        else:
+            busy = busy_pct(self._previous[0], counters, stamp - self._previous[1])
+            self._previous = (counters, stamp)
+        if DEBUG:
+            print(f'hitmp sample: time={stamp} busy={busy:.2f}% watts={watts}')
+        with self._lock:
+            self.samples.append((stamp, busy, watts))
+
+    def latest(self) -> float:
+        with self._lock:
+            return self.samples[-1][0] if self.samples else 0.0
+
+    def window(self, start: float, end: float, asof: float) -> Optional[Tuple[float, float]]:
+        '''Mean busy % and Watts of the samples stamped in (start, end], otherwise the
+        last sample stamped within asof seconds before end
+        '''
+        with self._lock:
+            samples = list(self.samples)
+        def mean(values):
+            values = [ v for v in values if not math.isnan(v) ]
+            return sum(values) / len(values) if values else math.nan
+
+        inside = [ s for s in samples if start < s[0] <= end ]
+        if inside:
+            return (mean([ s[1] for s in inside ]), mean([ s[2] for s in inside ]))
+        before = [ s for s in samples if end - asof < s[0] <= end ]
+        return (before[-1][1], before[-1][2]) if before else None
+
+
+class EfficiencyStage:
+    '''Time align vdbench rows with hitmp samples on interval boundaries and publish
+    the derived efficiency gauges per run
+    '''
+    def __init__(self, source: HitmpSource, columns: List[str], labelnames: List[str],
+                 registry: CollectorRegistry, align: float=15.0):
+        self.source = source
+        self.align = align
+        self.rate = columns.index('rate') if 'rate' in columns else None
+        self.mbps = columns.index('mb_sec') if 'mb_sec' in columns else None
+        self.gauges = { name: Gauge(METRIC_PREFIX + 'efficiency_' + name, doc, labelnames, registry=registry)
+                        for name, (_, _, doc) in EFFICIENCY_METRICS.items() }
+        self.gauges['busy_pct'] = Gauge(METRIC_PREFIX + 'aligned_mp_busy_pct',
+            'Average MP busy % aligned to the vdbench intervals', labelnames, registry=registry)
+        self.gauges['watts'] = Gauge(METRIC_PREFIX + 'aligned_power_watts',
+            'Storage power aligned to the vdbench intervals', labelnames, registry=registry)
+        self._bucket = None     # [start, labels, rate sum, mbps sum, rows]
+        self._pending = deque()
+
+    def add(self, timestamp: float, values: Tuple[float, ...], labels: Dict[str, str]):
+        if self.rate is None or self.mbps is None:
+            return
+        start = timestamp - timestamp % self.align
+        if self._bucket and (self._bucket[0] != start or self._bucket[1] != labels):
+            self._pending.append(self._bucket)
+            self._bucket = None
+        if not self._bucket:
+            self._bucket = [start, dict(labels), 0.0, 0.0, 0]
+        rate, mbps = values[self.rate], values[self.mbps]
+        if not math.isnan(rate) and not math.isnan(mbps):
+            self._bucket[2] += rate
+            self._bucket[3] += mbps
+            self._bucket[4] += 1
+        self.publish()
+
+    def publish(self, wait: bool=True):
+        '''Publish buckets once the hitmp data for them has arrived (or stopped arriving)
+        '''
+        latest = self.source.latest()
+        while self._pending:
+            start, labels, rate, mbps, rows = self._pending[0]
+            end = start + self.align
+            if wait and latest <= end and time.time() < end + 3 * self.align:
+                break
+            self._pending.popleft()
+            storage = self.source.window(start, end, 2 * self.align)
+            if not rows or not storage:
+                continue
+            measured = { 'rate': rate / rows, 'mb_sec': mbps / rows, 'busy_pct': storage[0], 'watts': storage[1] }
+            for name, (numerator, denominator, _) in EFFICIENCY_METRICS.items():
+                value = measured[denominator]
+                if value and not math.isnan(value):
+                    self.gauges[name].labels(**labels).set(measured[numerator] / value)
+            for name in ('busy_pct', 'watts'):
+                if not math.isnan(measured[name]):
+                    self.gauges[name].labels(**labels).set(measured[name])
+
+    def flush(self):
+        if self._bucket:
+            self._pending.append(self._bucket)
+            self._bucket = None
+        self.publish(wait=False)
@@ -4,10 +4,20 @@
 Monitor Vdbench and make available for prometheus to scrape
 """
 __author__  = "Mark Butterworth"
-__version__ = "0.1.0 20250218"
+__version__ = "0.9.2 20261019"
 __license__ = "MIT"
 
 # Ver 0.1.0 20250217  Initial version
+# Ver 0.2.0 20261019  Prometheus remote-write push mode (--push)
+# Ver 0.3.0 20261019  Response time histograms from histogram.html
+# Ver 0.4.0 20261019  Per host/slave interval metrics, one thread follows all output files
+# Ver 0.5.0 20261019  Shared bytes flatfile parser (vdb_flatfile), n/a is now NaN rather than 0
+# Ver 0.6.0 20261019  Efficiency metrics against hitmp_exporter MP busy and power (--hitmp)
+# Ver 0.7.0 20261019  Fan-out sink pipeline: Graphite, OpenMetrics file and columnar archive sinks
+# Ver 0.8.0 20261019  Online steady state detection with optional marker file / signal
+# Ver 0.9.0 20261019  Live ring buffer JSON/SSE query API (--live)
+# Ver 0.9.1 20261019  Steady state notifies an orchestrator PID/command, --steady-stop-vdbench to end the Vdbench job
+# Ver 0.9.2 20261019  Every sink drops (and counts) rows when its queue is full, --sink-block NAME for backpressure
 
 # MIT License
 
@@ -37,22 +47,36 @@ import argparse
 import psutil
 import time
 import signal
+import threading
+import functools
 
-from typing import Tuple, Optional, Union, TextIO
+from typing import Callable, List, Tuple, Optional, Union, TextIO
 from pathlib import Path
 from datetime import datetime
 from socket import gethostname
 
 import prometheus_client
 from prometheus_client import REGISTRY, start_http_server, CollectorRegistry, Gauge
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+from remote_write import RemoteWriter
+from vdb_histogram import HistogramParser, HistogramCollector, HISTOGRAM_FILE
+from vdb_flatfile import FlatfileParser, follow_rows
+from vdb_tailer import MultiTailer, IntervalParser, INTERVAL_COLUMNS, vdb_hosts, host_slave
+from vdb_efficiency import HitmpSource, EfficiencyStage
+from vdb_steady import SteadyStateStage
+from vdb_sinks import Sink, Pipeline, SinkCollector, GraphiteSink, OpenMetricsSink, ArchiveSink
+from vdb_live import LiveStore, LiveSink, start_live_server, LIVE_PORT
 
 DEBUG = 0
 VERBOSE = 0
 FORCE = False
 
 METRIC_PREFIX='vdbench_'
-# DATETIME_FORMAT = r'%m/%d/%Y %H:%M:%S.%f'
 EXPORTER_PORT = 8113
+PUSH_JOB = 'vdbench'
+GRAPHITE_ROOT = 'vdbench'
+SINK_NAMES = ('prometheus', 'graphite', 'openmetrics', 'archive', 'live')    # for --sink-block
 
 ###############################################################################
 
@@ -73,6 +97,23 @@ EXPORTER_PORT = 8113
 
 
 
+class RemoteWriteCollector:
+    '''Expose the remote-write queue statistics on /metrics
+    '''
+    def __init__(self, writer: RemoteWriter):
+        self.writer = writer
+
+    def collect(self):
+        stats = self.writer.stats()
+        for key in ('sent', 'dropped'):
+            yield CounterMetricFamily(METRIC_PREFIX + f'remote_write_samples_{key}',
+                                      f'Samples {key} by the remote-write push', value=stats[key])
+        yield CounterMetricFamily(METRIC_PREFIX + 'remote_write_failed_requests',
+                                  'Failed remote-write requests (including retries)', value=stats['failed_requests'])
+        yield GaugeMetricFamily(METRIC_PREFIX + 'remote_write_queued_samples',
+                                'Samples waiting to be pushed', value=stats['queued'])
+
+
 def sigterm_handler(signo, stack_frame):
     print(f'{signal.strsignal(signo)} received, Exiting...')
     # Raises SystemExit(0):
@@ -121,82 +162,161 @@ def vdb_alive(pid: int) -> bool:
     return False
 
 
-def follow(fd: TextIO , timeout: int=60, pid: int=0):
-    '''generator function that yields new lines added to a file
+def process_outputs(pid: int, outputdir: Path, labels: dict, registry: CollectorRegistry,
+                    histograms: HistogramCollector, stop: threading.Event):
+    '''Follow histogram.html and the per host/slave reports of a run on one thread
+    '''
+    hosts = vdb_hosts(outputdir)
+    baselabels = { k: v for k, v in labels.items() if k != 'run' }
+    labelnames = list(baselabels) + ['run', 'host', 'slave']
+    gauges = { col: Gauge(METRIC_PREFIX + 'host_' + col, 'Per host/slave interval ' + col, labelnames, registry=registry)
+               for col in INTERVAL_COLUMNS }
+    histparsers = []
+
+    def histogram_handler():
+        parser = HistogramParser()
+        histparsers.append(parser)
+        def handler(line: str):
+            done = parser.feed(line)
+            if done:
+                if DEBUG:
+                    print(f'Histogram: run={done[0]} op={done[1]} buckets={len(done[2])}')
+                histograms.add(*done)
+        return handler
+
+    def interval_handler(host: str, slave: str):
+        current = {}
+        def report(run: str, row: dict):
+            values = dict(baselabels, run=run, host=host, slave=slave)
+            if current and current != values:   # New run, drop the previous run series
+                for gauge in gauges.values():
+                    try:
+                        gauge.remove(*current.values())
+                    except KeyError:
+                        pass
+            for col, val in row.items():
+                gauges[col].labels(**values).set(val)
+            current.clear()
+            current.update(values)
+        return IntervalParser(report)
+
+    def discover(name: str):
+        if name == HISTOGRAM_FILE:
+            return histogram_handler()
+        hostslave = host_slave(name, hosts)
+        if hostslave:
+            if VERBOSE:
+                print(f'\nFollowing host={hostslave[0]} slave={hostslave[1]}: {name}')
+            return interval_handler(*hostslave)
+        return None
+
+    MultiTailer(outputdir, discover).run(stop, lambda: vdb_alive(pid) if pid else True)
+    for parser in histparsers:
+        done = parser.flush()
+        if done:
+            histograms.add(*done)
+
+
+class PrometheusSink(Sink):
+    '''Flatfile rows to the exporter gauges, plus the remote-write push and efficiency metrics
+    '''
+    name = 'prometheus'
+
+    def __init__(self, registry: CollectorRegistry, writer: Optional[RemoteWriter]=None,
+                 hitmp: Optional[HitmpSource]=None, align: float=15.0, steady: Optional[dict]=None,
+                 pid: Optional[int]=None, maxsize: int=10000, block: bool=False):
+        self.registry = registry
+        self.writer = writer
+        self.hitmp = hitmp
+        self.align = align
+        self.steady = steady or {}
+        self.pid = pid
+        self.efficiency = None
+        super().__init__(maxsize, block)
+
+    def begin(self, header, labels):
+        self.labels = labels
+        self.gauges = [ Gauge(METRIC_PREFIX + k , '', labels.keys(), registry=self.registry)
+                        for k in header.columns ]
+        self.metrics = [ METRIC_PREFIX + k for k in header.columns ]
+        self.lastrun = ''
+        if DEBUG:
+            print(self.gauges)
+        if self.hitmp:
+            self.efficiency = EfficiencyStage(self.hitmp, header.columns, list(labels), self.registry, self.align)
+        self.steadystate = SteadyStateStage(header.columns, list(labels), self.registry, stop_pid=self.pid, **self.steady)
+
+    def rows(self, rows):
+        labels, writer = self.labels, self.writer
+        for row in rows:
+            if row.run != self.lastrun:
+                for gauge in self.gauges:
+                    gauge.clear()
+                self.lastrun = row.run
+            labels['run'] = row.run
+            if writer:
+                timestamp = int(row.timestamp * 1000)
+                pushlabels = dict(labels, job=PUSH_JOB)
+            for gauge, metric, val in zip(self.gauges, self.metrics, row.values):
+                if DEBUG:
+                    print(metric, labels, val)
+                gauge.labels(**labels).set(val)
+                if writer:
+                    writer.append(metric, pushlabels, val, timestamp)
+            if self.efficiency:
+                self.efficiency.add(row.timestamp, row.values, labels)
+            self.steadystate.add(row.timestamp, row.values, labels)
+
+    def end(self):
+        if self.efficiency:
+            self.efficiency.flush()
+
+
+def process_flatfile(pid: int, flatfile: str, labels: Optional[dict]=None, writer: Optional[RemoteWriter]=None,
+                     hitmp: Optional[HitmpSource]=None, align: float=15.0, sinks: List[Callable[[], Sink]]=(),
+                     steady: Optional[dict]=None, block: bool=False):
+    '''The source stage: follow and parse the flatfile once, fanning the rows out to every sink
     '''
-    start = time.perf_counter()
-    while True:
-        line = fd.readline()
-        if not line:
-            if timeout and time.perf_counter() >= start+timeout:
-                print(f'\nWARNING: {timeout}sec timeout following: {fd.name}')
-                break
-            if pid and not vdb_alive(pid):
-                print(f'\nWARNING: Vdbench process no longer alive: {pid}')
-                break
-            time.sleep(0.25)
-            continue
-        yield line
-        start = time.perf_counter()
-
-
-def process_flatfile(pid: int, flatfile: str, labels: Optional[dict]=None):
     labels['run'] = ''
   
     # Rather than using the default REGISTRY, use our own:
     #    - Once destroyed will clear out prevous metrics.
     registry = CollectorRegistry()
     REGISTRY.register(registry)
-    header = None
-    with open(flatfile, 'r') as fd:
-        for line in follow(fd, 60):
-            line = line.strip()
-            if 'tod' in line:
-                header = line.split()
-                break
-        
-        if not header:
-            print(f'ERROR: Header not found in flatfile: {fd.name}')
-            return
-
-        header = [ x.lower().replace('/', '_').replace('%', '_pct') for x in header ]
-        print('Header:', header)
-        
-        gauges = { METRIC_PREFIX + k: Gauge(METRIC_PREFIX + k , '', labels.keys(), registry=registry) 
-                  for k in header[3:] }
-        if DEBUG:
-            print(gauges)
-
-        # fd.seek(0, os.SEEK_END)   # Go to end so we get the latest Summary Info
-        lastrun = ''
-        for line in follow(fd, 15, pid):
-            values = line.split()
-            if values[3].startswith('avg'):
-                continue
-            # logtime = values[1][:10] + ' ' + values[0]
-            # timestamp = datetime.strptime(logtime, DATETIME_FORMAT).timestamp()
-            run = values[2]
-            if run != lastrun:
-                print(f'\n{datetime.now().strftime("%Y-%m-%d %H:%M:%S")} Scraping run: {run} ...')
-                for k in gauges:
-                    gauges[k].clear()
-                lastrun = run
-            labels['run'] = run
-            for i, val in enumerate(values[3:]):
-                metric = METRIC_PREFIX + header[i+3]
-                # gauges[metric]._timestamp = timestamp
-                if val == 'n/a':
-                    val = '0'
-                if DEBUG:
-                    print(metric, labels, val)
-                gauges[metric].labels(**labels).set(val)
+
+    histograms = HistogramCollector(labels)
+    registry.register(histograms)
+    stop = threading.Event()
+    threading.Thread(target=process_outputs, args=(pid, Path(flatfile).parent, labels, registry, histograms, stop),
+                     name='outputs', daemon=True).start()
+
+    pipeline = Pipeline([ PrometheusSink(registry, writer, hitmp, align, steady, pid, block=block) ] + [ sink() for sink in sinks ])
+    registry.register(SinkCollector(pipeline))
+    parser = FlatfileParser()
+    lastrun = None
+    with open(flatfile, 'rb') as fd:
+        for row in follow_rows(fd, parser, 15, 60, lambda: vdb_alive(pid)):
+            if lastrun is None:
+                print('Header:', parser.header.names)
+                pipeline.begin(parser.header, labels)
+            if row.run != lastrun:
+                print(f'\n{datetime.now().strftime("%Y-%m-%d %H:%M:%S")} Scraping run: {row.run} ...')
+                lastrun = row.run
+            pipeline.row(row)
             if not DEBUG:
                 print('.', end='')
-        # Once complete unregister to avoid "Duplicate Metrics" errors:
-        REGISTRY.unregister(registry)
+
+    # Let the sinks drain (and write their files) before the metrics go:
+    pipeline.close()
+    if not parser.header:
+        print(f'ERROR: Header not found in flatfile: {flatfile}')
+    # Once complete unregister to avoid "Duplicate Metrics" errors:
+    stop.set()
+    REGISTRY.unregister(registry)
 
 
-def vdb_proc_monitor():
+def vdb_proc_monitor(writer: Optional[RemoteWriter]=None, hitmp: Optional[HitmpSource]=None, align: float=15.0,
+                     sinks: List[Callable[[], Sink]]=(), steady: Optional[dict]=None, block: bool=False):
     # Start the prometheus exporter web server:
     start_http_server(EXPORTER_PORT)
     toggle = True
@@ -213,7 +333,7 @@ def vdb_proc_monitor():
             hostname = os.environ.get('VDB_EXPORTER_HOSTNAME', gethostname())
             labels = { 'hostname': hostname, 'resultdir': vdb_flatfile.parent.name }
             print(f'Vdbench is active on PID: {vdb_pid} {labels}')
-            process_flatfile(vdb_pid, vdb_flatfile, labels)
+            process_flatfile(vdb_pid, vdb_flatfile, labels, writer, hitmp, align, sinks, steady, block)
 
         time.sleep(0.25)
 
@@ -227,6 +347,50 @@ def cli():
         help='Increase verbose level, e.g. -vv = level 2.')
     parser.add_argument('-f', '--force', action='store_true',
          help='Force')
+    parser.add_argument('-p', '--push', type=str, default=os.environ.get('VDB_EXPORTER_PUSH_URL'),
+         help='Also push every flatfile row to a Prometheus remote-write URL, e.g. http://prometheus:9090/api/v1/write')
+    parser.add_argument('--push-batch', type=int, default=2000,
+         help='Maximum samples per remote-write request')
+    parser.add_argument('--push-interval', type=float, default=1.0,
+         help='Maximum seconds to wait before sending a partial batch')
+    parser.add_argument('--push-queue', type=int, default=100000,
+         help='Maximum queued samples, samples are dropped (and counted) when full')
+    parser.add_argument('--hitmp', type=str, default=os.environ.get('VDB_EXPORTER_HITMP_URL'),
+         help='Publish efficiency metrics (IOPS & MB/s per MP busy %% and per Watt) using this hitmp_exporter, e.g. http://array-host:8213/metrics')
+    parser.add_argument('--align', type=float, default=15.0,
+         help='Seconds per aligned interval for the efficiency metrics, normally the hitmp_exporter interval')
+    parser.add_argument('-g', '--graphite', type=str, default=os.environ.get('VDB_EXPORTER_GRAPHITE'),
+         help='Also send rows to carbon (pickle protocol) at HOST[:PORT], replaces running vdb2graphite alongside')
+    parser.add_argument('--openmetrics-dir', type=str,
+         help='Write each result as a timestamped OpenMetrics file (promtool backfill) into this directory')
+    parser.add_argument('--archive-dir', type=str,
+         help='Write each result as a columnar archive (zip of float64 arrays) into this directory')
+    parser.add_argument('--sink-queue', type=int, default=10000,
+         help='Maximum queued rows per sink, rows are dropped (and counted) when a sink queue is full')
+    parser.add_argument('--sink-block', type=str, action='append', default=[], choices=SINK_NAMES,
+         help='Hold up the flatfile reader rather than drop rows when this sink queue is full (repeatable)')
+    parser.add_argument('-l', '--live', type=int, nargs='?', const=LIVE_PORT,
+         help=f'Serve the last --live-minutes of every column as JSON/SSE on this port (default {LIVE_PORT}): /live/runs /live/range /live/stream')
+    parser.add_argument('--live-minutes', type=float, default=10,
+         help='Minutes of 1 second intervals held per run for --live')
+    parser.add_argument('--steady-window', type=int, default=30,
+         help='Intervals in the steady state window (rate and resp)')
+    parser.add_argument('--steady-cv', type=float, default=0.1,
+         help='Maximum coefficient of variation (stddev / mean) over the window for steady state')
+    parser.add_argument('--steady-slope', type=float, default=0.1,
+         help='Maximum fitted change across the window, relative to the mean, for steady state')
+    parser.add_argument('--steady-marker', type=str,
+         help='Write a JSON marker file when a run reaches steady state, e.g. /results/{resultdir}/{run}.steady')
+    parser.add_argument('--steady-notify-pid', type=int,
+         help='Send --steady-signal to this PID (e.g. the orchestrator driving Vdbench) when a run reaches steady state')
+    parser.add_argument('--steady-signal', type=str, default='USR1',
+         help='Signal for --steady-notify-pid')
+    parser.add_argument('--steady-command', type=str,
+         help='Run this command when a run reaches steady state, may use {hostname} {resultdir} {run}, '
+              'the JSON marker record is in $VDB_STEADY_STATE')
+    parser.add_argument('--steady-stop-vdbench', type=str, metavar='SIGNAL',
+         help='Send this signal to the Vdbench process at steady state, e.g. TERM. '
+              'This terminates the WHOLE Vdbench job (all remaining runs), not only the current run')
 
     args = parser.parse_args()
     global DEBUG, VERBOSE, FORCE
@@ -246,7 +410,55 @@ def cli():
     REGISTRY.unregister(prometheus_client.GC_COLLECTOR)
     REGISTRY.unregister(prometheus_client.PLATFORM_COLLECTOR)
     REGISTRY.unregister(prometheus_client.PROCESS_COLLECTOR)
-    vdb_proc_monitor()
+
+    writer = None
+    if args.push:
+        try:
+            writer = RemoteWriter(args.push, batch_size=args.push_batch,
+                                  batch_interval=args.push_interval, max_queue=args.push_queue)
+        except ValueError as e:
+            print(f'ERROR: {e}')
+            return 30
+        REGISTRY.register(RemoteWriteCollector(writer))
+        print(f'Pushing samples to remote-write endpoint: {args.push}')
+    hitmp = None
+    if args.hitmp:
+        hitmp = HitmpSource(args.hitmp)
+        print(f'Efficiency metrics using hitmp_exporter: {args.hitmp}')
+    steady = { 'window': args.steady_window, 'max_cv': args.steady_cv, 'max_slope': args.steady_slope,
+               'marker': args.steady_marker, 'notify_pid': args.steady_notify_pid, 'command': args.steady_command }
+    if args.steady_window < 2:
+        print('ERROR: --steady-window must be at least 2 intervals')
+        return 20
+    for key, name in (('signo', args.steady_signal), ('stop_signo', args.steady_stop_vdbench)):
+        if not name:
+            continue
+        try:
+            steady[key] = signal.Signals['SIG' + name.upper().removeprefix('SIG')]
+        except KeyError:
+            print(f'ERROR: Unknown signal: {name}')
+            return 20
+
+    sinks = []
+    if args.graphite:
+        hostname = os.environ.get('VDB_EXPORTER_HOSTNAME', gethostname())
+        sinks.append(functools.partial(GraphiteSink, args.graphite, GRAPHITE_ROOT + '.' + hostname, args.sink_queue,
+                                       'graphite' in args.sink_block))
+    if args.openmetrics_dir:
+        sinks.append(functools.partial(OpenMetricsSink, args.openmetrics_dir, args.sink_queue,
+                                       'openmetrics' in args.sink_block))
+    if args.archive_dir:
+        sinks.append(functools.partial(ArchiveSink, args.archive_dir, args.sink_queue, 'archive' in args.sink_block))
+    if args.live:
+        store = LiveStore(args.live_minutes)
+        start_live_server(args.live, store)
+        sinks.append(functools.partial(LiveSink, store, args.sink_queue, 'live' in args.sink_block))
+        print(f'Live query API on port: {args.live}')
+    try:
+        vdb_proc_monitor(writer, hitmp, args.align, sinks, steady, 'prometheus' in args.sink_block)
+    finally:
+        if writer:
+            writer.close()
  
     return rc          
 
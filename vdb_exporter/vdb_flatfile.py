@@ -0,0 +1,347 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Shared Vdbench flatfile.html parser working on raw bytes, used by vdb_exporter, vdb2graphite and hit2om
+"""
+__author__  = "Mark Butterworth"
+__version__ = "0.2.0 20261019"
+__license__ = "MIT"
+
+# Ver 0.1.0 20261019  Initial version
+# Ver 0.1.1 20261019  Hour of the row time from tod (not the rounded stamp), benchmark against the real prior loop
+# Ver 0.2.0 20261019  Values converted per block into one array('d'), optional C accelerator (_vdb_flatfile)
+
+# MIT License
+
+# Copyright (c) 2023 Mark Butterworth
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import io
+import sys
+import time
+import math
+import calendar
+import argparse
+
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple, BinaryIO, TextIO
+from array import array
+from pathlib import Path
+
+try:
+    import _vdb_flatfile        # Optional C accelerator, see setup.py
+except ImportError:
+    _vdb_flatfile = None
+
+DEBUG = 0
+VERBOSE = 0
+FORCE = False
+
+FLATFILE = 'flatfile.html'
+NAN = math.nan
+UTC_ZONES = (b'UTC', b'GMT', b'Z')
+READ_SIZE = 1 << 16
+
+# Header and first columns of a flatfile interval row:
+#          tod             timestamp        Run  interval   reqrate      rate    MB/sec ...
+#   10:15:01.012 02/18/2025-10:15:01-UTC  rd1_(1)         1   10000.0    9998.0     39.05 ...
+# The metric columns are from "interval" onwards, "avg_" intervals are run summaries.
+FIRST_METRIC = 3
+
+###############################################################################
+
+
+def normalize_column(name: str) -> str:
+    return name.lower().replace('/', '_').replace('%', '_pct')
+
+
+class Row(NamedTuple):
+    timestamp: float        # epoch seconds
+    run: str
+    values: Sequence[float]     # aligned with FlatfileHeader.columns, n/a is NaN. A read-only
+                                # memoryview slice of the parsed block's array('d')
+
+
+class FlatfileHeader:
+    def __init__(self, line: bytes):
+        self.names = [ normalize_column(x) for x in line.decode(errors='replace').split() ]
+        self.columns = self.names[FIRST_METRIC:]
+        self.width = len(self.names)
+
+    def __repr__(self):
+        return f'FlatfileHeader({self.names})'
+
+
+class FlatfileParser:
+    '''Incremental flatfile parser, feed() raw bytes as they are read and get back typed rows.
+
+    The header is handled once, rows are split as bytes (no per line decoding) and the
+    timestamp is built from a per hour cache instead of calling strptime for every row.
+    With the _vdb_flatfile accelerator built a whole block is converted in C straight from
+    the read buffer, the Python path is the fallback and gives the same rows.
+    '''
+    def __init__(self):
+        self.header: Optional[FlatfileHeader] = None
+        self._partial = b''
+        self._hours: Dict[bytes, float] = {}
+
+    def feed(self, data: bytes) -> List[Row]:
+        if self._partial:
+            data = self._partial + data
+        end = data.rfind(b'\n') + 1
+        self._partial = data[end:]
+        return self.parse(memoryview(data)[:end])
+
+    def flush(self) -> List[Row]:
+        data, self._partial = self._partial, b''
+        return self.parse(data)
+
+    def parse(self, data) -> List[Row]:
+        '''Parse whole lines, data is bytes or a memoryview of the read buffer'''
+        if not data:
+            return []
+        if not self.header:
+            lines = bytes(data).split(b'\n')
+            for i, line in enumerate(lines):
+                if b'tod' in line.split():
+                    self.header = FlatfileHeader(line)
+                    data = b'\n'.join(lines[i+1:])
+                    break
+            else:
+                return []
+        if _vdb_flatfile:
+            rows = _vdb_flatfile.parse_block(data, self.header.width, FIRST_METRIC, Row, self._hour_base)
+            if rows is not None:
+                return rows
+        data = bytes(data).replace(b'n/a', b'nan')    # float(b'nan') is NaN
+        rows = self._parse_block(data)
+        if rows is None:
+            rows = []
+            for line in data.split(b'\n'):
+                rows += self._parse_block(line) or []
+        return rows
+
+    def _parse_block(self, data: bytes) -> Optional[List[Row]]:
+        '''Parse whole lines as one token stream, a slice of tokens per row.
+        The values of the whole block are converted into one array, each row gets a slice of it.
+        Returns None when the block is not purely interval rows (the caller then goes line by line).
+        '''
+        width = self.header.width
+        tokens = data.split()
+        if len(tokens) % width:
+            return None
+        hour_base = self._hour_base
+        stamps, runs, metrics = [], [], []
+        try:
+            for i in range(0, len(tokens), width):
+                tod = tokens[i]
+                if tod[2:3] != b':':
+                    return None
+                if tokens[i+3].startswith(b'avg'):
+                    continue
+                stamps.append(hour_base(tokens[i+1], tod[:2]) + int(tod[3:5]) * 60 + float(tod[6:]))
+                runs.append(tokens[i+2].decode(errors='replace'))
+                metrics += tokens[i+FIRST_METRIC:i+width]
+            values = memoryview(array('d', map(float, metrics))).toreadonly()
+        except ValueError:
+            return None
+        columns = width - FIRST_METRIC
+        return [ Row(stamp, run, values[n*columns:(n+1)*columns])
+                 for n, (stamp, run) in enumerate(zip(stamps, runs)) ]
+
+    def _hour_base(self, stamp: bytes, hour: bytes) -> float:
+        # stamp=b'02/18/2025-10:15:01-UTC', hour=b'10' from tod: cache the epoch of the date and tod hour.
+        # The stamp is whole seconds and can be an hour (or a day) ahead of a tod like 10:59:59.998,
+        # so only its date is used, moved back/forward a day when the hours straddle midnight.
+        key = stamp[:13] + stamp[19:] + hour
+        base = self._hours.get(key)
+        if base is None:
+            month, day, year = int(stamp[:2]), int(stamp[3:5]), int(stamp[6:10])
+            todhour = int(hour)
+            shift = todhour - int(stamp[11:13])
+            if shift > 12:
+                day -= 1
+            elif shift < -12:
+                day += 1
+            tm = (year, month, day, todhour, 0, 0, 0, 0, -1)     # out of range days are normalised
+            if stamp[20:] in UTC_ZONES:
+                base = float(calendar.timegm(tm))
+            else:
+                base = time.mktime(tm)     # Local time, as vdbench reports it
+            self._hours[key] = base
+        return base
+
+
+def to_columns(header: FlatfileHeader, rows: List[Row]) -> Dict[str, array]:
+    '''Column batch view of rows: {'timestamp': array, <column>: array, ...}
+    '''
+    batch = { 'timestamp': array('d', (row.timestamp for row in rows)) }
+    for i, col in enumerate(header.columns):
+        batch[col] = array('d', (row.values[i] for row in rows))
+    return batch
+
+
+def read_flatfile(flatfile: Path) -> Tuple[Optional[FlatfileHeader], List[Row]]:
+    '''Parse a complete flatfile in one read
+    '''
+    parser = FlatfileParser()
+    with open(flatfile, 'rb') as fd:
+        rows = parser.feed(fd.read())
+    rows += parser.flush()
+    return parser.header, rows
+
+
+def follow_rows(fd: BinaryIO, parser: FlatfileParser, timeout: float=15, header_timeout: float=60,
+                alive: Optional[Callable[[], bool]]=None) -> Iterator[Row]:
+    '''generator function that yields rows as they are appended to a flatfile
+    '''
+    start = time.perf_counter()
+    while True:
+        data = fd.read(READ_SIZE)
+        if not data:
+            limit = timeout if parser.header else header_timeout
+            if limit and time.perf_counter() >= start+limit:
+                print(f'\nWARNING: {limit}sec timeout following: {fd.name}')
+                break
+            if alive and not alive():
+                print(f'\nWARNING: Vdbench process no longer alive')
+                break
+            time.sleep(0.25)
+            continue
+        yield from parser.feed(data)
+        start = time.perf_counter()
+    yield from parser.flush()
+
+
+###############################################################################
+
+
+def prior_rows(fd: TextIO) -> Iterator[Tuple[str, List[str]]]:
+    '''The previous exporter loop: follow() readline, split and the n/a check per value.
+    The values stay strings, Gauge.set() converted them to float afterwards.
+    '''
+    def follow(fd):
+        while True:
+            line = fd.readline()
+            if not line:
+                return
+            yield line
+
+    header = None
+    for line in follow(fd):
+        line = line.strip()
+        if 'tod' in line:
+            header = line.split()
+            break
+    header = [ x.lower().replace('/', '_').replace('%', '_pct') for x in header ]
+    for line in follow(fd):
+        values = line.split()
+        if values[3].startswith('avg'):
+            continue
+        row = []
+        for i, val in enumerate(values[3:]):
+            if val == 'n/a':
+                val = '0'
+            row.append(val)
+        yield values[2], row
+
+
+def synthetic_flatfile(rows: int, columns: int=40) -> bytes:
+    names = [ 'tod', 'timestamp', 'Run', 'interval', 'reqrate', 'rate', 'MB/sec', 'bytes/io', 'read%', 'resp' ]
+    names += [ f'col{i}' for i in range(columns - len(names)) ]
+    lines = [ '* Vdbench flatfile', '  '.join(names) ]
+    start = 1739873700
+    for i in range(rows):
+        t = time.gmtime(start + i)
+        values = [ f'{1000+i%97:.3f}' if c % 11 else 'n/a' for c in range(columns - 4) ]
+        lines.append(f'{time.strftime("%H:%M:%S", t)}.012 {time.strftime("%m/%d/%Y-%H:%M:%S", t)}-UTC rd1 {i+1} ' + ' '.join(values))
+    return ('\n'.join(lines) + '\n').encode()
+
+
+def benchmark(rows: int, repeat: int=3) -> int:
+    data = synthetic_flatfile(rows)
+    print(f'Synthetic flatfile: {rows} rows, {len(data)/1024/1024:.1f} MiB, best of {repeat} runs')
+
+    # Rows are consumed as they are produced, as the exporter does, nothing is kept:
+    def prior():
+        return sum(1 for _ in prior_rows(io.TextIOWrapper(io.BytesIO(data))))
+
+    def parse():
+        parser = FlatfileParser()
+        parsed = 0
+        for pos in range(0, len(data), READ_SIZE):
+            parsed += len(parser.feed(data[pos:pos+READ_SIZE]))
+        return parsed + len(parser.flush())
+
+    def best(func):
+        secs = math.inf
+        for _ in range(repeat):
+            start = time.perf_counter()
+            count = func()
+            secs = min(secs, time.perf_counter() - start)
+        return count, secs
+
+    count, prior_secs = best(prior)
+    parsed, secs = best(parse)
+    if parsed != count:
+        print(f'ERROR: row count mismatch: {parsed} != {count}')
+        return 30
+    path = 'C accelerator' if _vdb_flatfile else 'Python, _vdb_flatfile not built'
+    print(f'Prior exporter loop:  {prior_secs:.3f}s  {rows/prior_secs:12,.0f} rows/s')
+    print(f'FlatfileParser:       {secs:.3f}s  {rows/secs:12,.0f} rows/s  ({path})')
+    print(f'Speedup:              {prior_secs/secs:.2f}x')
+    return 0
+
+
+def cli():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.version = __version__
+    parser.add_argument('-V', '--version', action='version')
+    parser.add_argument('-D', '--debug', action='count',
+        help='Increase debug level, e.g. -DDD = level 3.')
+    parser.add_argument('-b', '--benchmark', type=int, metavar='ROWS',
+         help='Benchmark against the previous exporter loop with a synthetic flatfile')
+    parser.add_argument('flatfiles', type=str, nargs='*',
+         help='Parse and summarise flatfile(s)')
+
+    args = parser.parse_args()
+    global DEBUG
+    if args.debug:
+        DEBUG = args.debug
+        print('Python version:', sys.version)
+        print('DEBUG LEVEL:', args.debug)
+        print('Arguments:', args)
+
+    if args.benchmark:
+        return benchmark(args.benchmark)
+    for flatfile in args.flatfiles:
+        header, rows = read_flatfile(Path(flatfile))
+        if not header:
+            print(f'ERROR: Header not found in flatfile: {flatfile}')
+            return 20
+        runs = sorted({ row.run for row in rows })
+        print(f'{flatfile}: {len(rows)} intervals, runs: {" ".join(runs)}')
+        if DEBUG:
+            print(header)
+    return 0
+
+
+if __name__=='__main__':
+    retcode = cli()
+    exit(retcode)
@@ -0,0 +1,154 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Parse the Vdbench response time histogram (histogram.html) into Prometheus histograms
+"""
+__author__  = "Mark Butterworth"
+__version__ = "0.1.1 20261019"
+__license__ = "MIT"
+
+# Ver 0.1.0 20261019  Initial version
+# Ver 0.1.1 20261019  Only bucket rows (range and count) inside a bucket table are parsed
+
+# MIT License
+
+# Copyright (c) 2023 Mark Butterworth
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import re
+import threading
+
+from typing import Dict, List, Tuple, Optional
+
+from prometheus_client.core import HistogramMetricFamily
+
+DEBUG = 0
+
+METRIC_PREFIX = 'vdbench_'
+HISTOGRAM_FILE = 'histogram.html'
+
+RUN_MATCH = re.compile(r'\bRD=([^;,\s]+)')
+OPERATIONS = ('read', 'write', 'total')
+
+# Vdbench writes a bucket table for each run, e.g.:
+#
+#   20:35:59.017 Starting RD=rd1; I/O rate: Uncontrolled MAX; elapsed=30; For loops: None
+#   ...
+#   Total of all requests:
+#        min(ms) - max(ms)          count     %%    cum%%
+#          0.000 -   0.005              0   0.00%   0.00%
+#          ...
+#        200.000 -     max              3   0.00% 100.00%
+#
+# A table starts at its min(ms)/max(ms) column header and ends at the first line that is
+# not a bucket row "<lower> <sep> <upper> <count> [%% cum%% ...]" where sep is '-' or '<'.
+
+TABLE_HEADER = re.compile(r'min\(ms\).*max\(ms\)', re.IGNORECASE)
+BUCKET_ROW = re.compile(r'^\s*(\d+(?:\.\d*)?)\s*[-<]\s*(\d+(?:\.\d*)?|max)\s+(\d+)(?:\s|$)', re.IGNORECASE)
+
+# (upper bound in seconds, count) for each bucket in ascending order
+Buckets = List[Tuple[float, int]]
+
+###############################################################################
+
+
+def parse_bucket(line: str) -> Optional[Tuple[float, float, int]]:
+    match = BUCKET_ROW.match(line)
+    if not match:
+        return None
+    lower, upper, count = match.groups()
+    return float(lower), float('inf') if upper.lower() == 'max' else float(upper), int(count)
+
+
+class HistogramParser:
+    '''Incremental line parser returning each completed bucket table as (run, op, buckets).
+    '''
+    def __init__(self):
+        self.run = ''
+        self.op = 'total'
+        self._table = False
+        self._buckets = []
+        self._sum = 0.0
+
+    def feed(self, line: str) -> Optional[Tuple[str, str, Buckets, float]]:
+        if self._table:
+            bucket = parse_bucket(line)
+            if bucket:
+                lower, upper, count = bucket
+                self._buckets.append((upper / 1000, count))    # ms -> seconds
+                # The sum is estimated from bucket midpoints as vdbench only reports counts:
+                midpoint = lower if upper == float('inf') else (lower+upper) / 2
+                self._sum += count * midpoint / 1000
+                return None
+            self._table = False
+
+        done = self.flush()
+        if TABLE_HEADER.search(line):
+            self._table = True
+            return done
+        match = RUN_MATCH.search(line)
+        if match:
+            self.run = match.group(1)
+        stripped = line.strip().lower()
+        if stripped.endswith(':'):
+            for op in OPERATIONS:
+                if stripped.startswith(op):
+                    self.op = op
+        return done
+
+    def flush(self) -> Optional[Tuple[str, str, Buckets, float]]:
+        if not self._buckets:
+            return None
+        done = (self.run, self.op, self._buckets, self._sum)
+        self._buckets = []
+        self._sum = 0.0
+        self.op = 'total'
+        return done
+
+
+class HistogramCollector:
+    '''Publish the latest response time histogram per run and operation
+    '''
+    def __init__(self, labels: Dict[str, str]):
+        self.labels = dict(labels)
+        self.labels.pop('run', None)
+        self._lock = threading.Lock()
+        self._histograms = {}
+
+    def add(self, run: str, op: str, buckets: Buckets, sum_value: float):
+        cumulative = []
+        total = 0
+        for upper, count in sorted(buckets):
+            total += count
+            cumulative.append(('+Inf' if upper == float('inf') else repr(upper), total))
+        if cumulative[-1][0] != '+Inf':
+            cumulative.append(('+Inf', total))
+        with self._lock:
+            self._histograms[(run, op)] = (cumulative, sum_value)
+
+    def collect(self):
+        family = HistogramMetricFamily(METRIC_PREFIX + 'response_seconds',
+            'Vdbench response time distribution per run (sum estimated from bucket midpoints)',
+            labels=list(self.labels) + ['run', 'op'])
+        with self._lock:
+            histograms = list(self._histograms.items())
+        for (run, op), (buckets, sum_value) in histograms:
+            family.add_metric(list(self.labels.values()) + [run, op], buckets, sum_value)
+        yield family
@@ -0,0 +1,344 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Last N minutes of every Vdbench flatfile column in fixed size ring buffers, served as JSON and SSE
+"""
+__author__  = "Mark Butterworth"
+__version__ = "0.1.3 20261019"
+__license__ = "MIT"
+
+# Ver 0.1.0 20261019  Initial version
+# Ver 0.1.1 20261019  SSE streams follow a change of flatfile columns, or end with an error event
+# Ver 0.1.2 20261019  LiveSink drops (and counts) rows when its queue is full unless block=True
+# Ver 0.1.3 20261019  RingBuffer.tail() for the rows streamed since the last event
+
+# MIT License
+
+# Copyright (c) 2023 Mark Butterworth
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import json
+import math
+import threading
+
+from typing import Dict, List, Optional, Tuple
+from array import array
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+from vdb_flatfile import FlatfileHeader, Row
+from vdb_sinks import Sink
+
+DEBUG = 0
+
+LIVE_PORT = 8114
+KEEP_RUNS = 8
+AGGREGATES = {
+    'mean': lambda v: math.fsum(v) / len(v),
+    'max': max,
+    'min': min,
+    'last': lambda v: v[-1],
+}
+
+###############################################################################
+
+
+class RingBuffer:
+    '''Fixed size numeric history of one run: a float64 array per column plus timestamps
+    '''
+    def __init__(self, columns: List[str], capacity: int):
+        self.columns = columns
+        self.capacity = capacity
+        self.timestamps = array('d', bytes(8 * capacity))
+        self.values = [ array('d', bytes(8 * capacity)) for _ in columns ]
+        self.count = 0          # rows ever appended, the next row goes to count % capacity
+
+    def append(self, timestamp: float, values: Tuple[float, ...]):
+        i = self.count % self.capacity
+        self.timestamps[i] = timestamp
+        for column, val in zip(self.values, values):
+            column[i] = val
+        self.count += 1
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def _index(self, n: int) -> int:
+        # nth oldest row held to its array slot
+        return (self.count - len(self) + n) % self.capacity
+
+    def _search(self, timestamp: float) -> int:
+        # first held row at or after timestamp
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.timestamps[self._index(mid)] < timestamp:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def first(self) -> float:
+        return self.timestamps[self._index(0)] if len(self) else math.nan
+
+    def last(self) -> float:
+        return self.timestamps[self._index(len(self) - 1)] if len(self) else math.nan
+
+    def tail(self, n: int, columns: List[str]) -> Tuple[List[float], Dict[str, List[float]]]:
+        '''The newest n rows held, oldest first
+        '''
+        slots = [ self._index(k) for k in range(max(0, len(self) - n), len(self)) ]
+        values = { col: [ self.values[self.columns.index(col)][i] for i in slots ] for col in columns }
+        return [ self.timestamps[i] for i in slots ], values
+
+    def range(self, start: float, end: float, columns: List[str], step: float=0,
+              agg: str='mean') -> Tuple[List[float], Dict[str, List[float]]]:
+        '''Rows within [start, end], downsampled to step second buckets when step > 0
+        '''
+        selected = [ (col, self.values[self.columns.index(col)]) for col in columns ]
+        slots = [ self._index(n) for n in range(self._search(start), len(self))
+                  if self.timestamps[self._index(n)] <= end ]
+        timestamps = [ self.timestamps[i] for i in slots ]
+        values = { col: [ column[i] for i in slots ] for col, column in selected }
+        if step <= 0 or not slots:
+            return timestamps, values
+
+        function = AGGREGATES[agg]
+        buckets = []
+        bounds = []
+        for n, t in enumerate(timestamps):
+            bucket = t - t % step
+            if not buckets or buckets[-1] != bucket:
+                buckets.append(bucket)
+                bounds.append(n)
+        bounds.append(len(timestamps))
+        down = {}
+        for col, vals in values.items():
+            down[col] = []
+            for lo, hi in zip(bounds, bounds[1:]):
+                valid = [ v for v in vals[lo:hi] if not math.isnan(v) ]
+                down[col].append(function(valid) if valid else math.nan)
+        return buckets, down
+
+
+class LiveStore:
+    '''The ring buffers of the most recent runs, shared by the live sink and the HTTP server
+    '''
+    def __init__(self, minutes: float=10, interval: float=1, keep_runs: int=KEEP_RUNS):
+        self.capacity = max(2, int(minutes * 60 / interval))
+        self.keep_runs = keep_runs
+        self.labels = {}
+        self.columns = []
+        self.runs: 'OrderedDict[str, RingBuffer]' = OrderedDict()
+        self.sequence = 0       # rows appended, for the SSE streams
+        self.generation = 0     # flatfiles begun, the columns may differ between them
+        self.lock = threading.Condition()
+
+    def begin(self, header: FlatfileHeader, labels: Dict[str, str]):
+        with self.lock:
+            self.labels = { k: v for k, v in labels.items() if k != 'run' }
+            self.columns = list(header.columns)
+            self.runs.clear()
+            self.generation += 1
+
+    def append(self, rows: List[Row]):
+        with self.lock:
+            for row in rows:
+                ring = self.runs.get(row.run)
+                if ring is None:
+                    ring = self.runs[row.run] = RingBuffer(self.columns, self.capacity)
+                    while len(self.runs) > self.keep_runs:
+                        self.runs.popitem(last=False)
+                ring.append(row.timestamp, row.values)
+                self.sequence += 1
+            self.lock.notify_all()
+
+    def latest_run(self) -> Optional[str]:
+        return next(reversed(self.runs), None)
+
+
+class LiveSink(Sink):
+    '''Feed the parsed flatfile rows into the LiveStore ring buffers
+    '''
+    name = 'live'
+
+    def __init__(self, store: LiveStore, maxsize: int=10000, block: bool=False):
+        self.store = store
+        super().__init__(maxsize, block)
+
+    def begin(self, header: FlatfileHeader, labels: Dict[str, str]):
+        self.store.begin(header, labels)
+
+    def rows(self, rows: List[Row]):
+        self.store.append(rows)
+
+
+def _json(value) -> bytes:
+    # NaN (n/a) is not valid JSON, send null
+    def clean(v):
+        if isinstance(v, float) and math.isnan(v):
+            return None
+        if isinstance(v, list):
+            return [ clean(x) for x in v ]
+        if isinstance(v, dict):
+            return { k: clean(x) for k, x in v.items() }
+        return v
+    return json.dumps(clean(value), separators=(',', ':')).encode()
+
+
+class LiveHandler(BaseHTTPRequestHandler):
+    '''
+    GET /live/runs                          labels, columns and the buffered runs
+    GET /live/range?columns=rate,resp       run= (default latest), last= seconds (default 60)
+                   or start=&end= epoch, step= seconds to downsample with agg=mean|max|min|last
+    GET /live/stream?columns=rate,resp      Server-Sent Events, one event per new row, a "columns" event
+                                            when a new flatfile changes them, an "error" event (and the
+                                            stream ends) when a requested column is no longer there
+    '''
+    store: LiveStore = None
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = { k: v[-1] for k, v in parse_qs(url.query).items() }
+        try:
+            if url.path == '/live/runs':
+                self._send(self._runs())
+            elif url.path == '/live/range':
+                self._send(self._range(query))
+            elif url.path == '/live/stream':
+                self._stream(query)
+            else:
+                self.send_error(404)
+        except (KeyError, ValueError) as e:
+            self.send_error(400, str(e))
+
+    def _columns(self, query: dict) -> List[str]:
+        columns = query['columns'].split(',') if query.get('columns') else self.store.columns
+        unknown = [ col for col in columns if col not in self.store.columns ]
+        if unknown:
+            raise ValueError(f'Unknown columns: {",".join(unknown)}')
+        return columns
+
+    def _runs(self) -> dict:
+        with self.store.lock:
+            return { 'labels': self.store.labels, 'columns': self.store.columns, 'capacity': self.store.capacity,
+                     'runs': [ { 'run': run, 'first': ring.first(), 'last': ring.last(), 'rows': len(ring) }
+                               for run, ring in self.store.runs.items() ] }
+
+    def _range(self, query: dict) -> dict:
+        agg = query.get('agg', 'mean')
+        if agg not in AGGREGATES:
+            raise ValueError(f'Unknown agg: {agg}')
+        step = float(query.get('step', 0))
+        with self.store.lock:
+            columns = self._columns(query)
+            run = query.get('run') or self.store.latest_run()
+            ring = self.store.runs.get(run)
+            if ring is None:
+                return { 'run': run, 'timestamps': [], 'values': { col: [] for col in columns } }
+            end = float(query['end']) if 'end' in query else math.inf
+            if 'start' in query:
+                start = float(query['start'])
+            else:
+                start = (ring.last() if end == math.inf else end) - float(query.get('last', 60))
+            timestamps, values = ring.range(start, end, columns, step, agg)
+        return { 'run': run, 'labels': self.store.labels, 'step': step, 'timestamps': timestamps, 'values': values }
+
+    def _send(self, body: dict):
+        data = _json(body)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Cache-Control', 'no-store')
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _stream(self, query: dict):
+        with self.store.lock:
+            columns = self._columns(query)
+            generation = self.store.generation
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Cache-Control', 'no-store')
+        self.end_headers()
+        with self.store.lock:
+            sequence = self.store.sequence
+        try:
+            while True:
+                changed, error = False, None
+                with self.store.lock:
+                    if not self.store.lock.wait_for(lambda: self.store.sequence != sequence, timeout=15):
+                        events = None
+                    else:
+                        if self.store.generation != generation:
+                            # A new flatfile began, resolve the columns against its header
+                            generation, changed = self.store.generation, True
+                            try:
+                                columns = self._columns(query)
+                            except ValueError as e:
+                                error = str(e)
+                        events = [] if error else self._new_rows(sequence, query.get('run'), columns)
+                        sequence = self.store.sequence
+                if error:
+                    self.wfile.write(b'event: error\ndata: ' + _json({ 'error': error }) + b'\n\n')
+                    self.wfile.flush()
+                    return
+                if changed:
+                    self.wfile.write(b'event: columns\ndata: ' + _json({ 'columns': columns }) + b'\n\n')
+                if events is None:
+                    self.wfile.write(b': keepalive\n\n')
+                else:
+                    for event in events:
+                        self.wfile.write(b'data: ' + _json(event) + b'\n\n')
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def _new_rows(self, sequence: int, run: Optional[str], columns: List[str]) -> List[dict]:
+        # Rows appended since sequence, these are always the newest rows of the latest run(s)
+        new = min(self.store.sequence - sequence, self.store.capacity)
+        events = []
+        for name, ring in reversed(self.store.runs.items()):
+            if new <= 0:
+                break
+            take = min(new, len(ring))
+            new -= take
+            if run and name != run:
+                continue
+            timestamps, values = ring.tail(take, columns)
+            events = [ { 'run': name, 'timestamp': timestamp,
+                         'values': { col: values[col][k] for col in columns } }
+                       for k, timestamp in enumerate(timestamps) ] + events
+        return events
+
+    def log_message(self, format, *args):
+        if DEBUG > 1:
+            super().log_message(format, *args)
+
+
+def start_live_server(port: int, store: LiveStore, addr: str='') -> ThreadingHTTPServer:
+    handler = type('Handler', (LiveHandler,), { 'store': store })
+    httpd = ThreadingHTTPServer((addr, port), handler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, name='live_http', daemon=True).start()
+    return httpd
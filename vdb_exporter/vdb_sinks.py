@@ -0,0 +1,333 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Fan-out of one parsed Vdbench flatfile stream to pluggable sinks, each with its own bounded queue and worker
+"""
+__author__  = "Mark Butterworth"
+__version__ = "0.2.0 20261019"
+__license__ = "MIT"
+
+# Ver 0.1.0 20261019  Initial version
+# Ver 0.1.1 20261019  Column sinks end cleanly when begin() never ran
+# Ver 0.2.0 20261019  Sinks drop (and count) by default, block per sink; column sinks spool in bounded chunks, run index uint32
+
+# MIT License
+
+# Copyright (c) 2023 Mark Butterworth
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import sys
+import json
+import math
+import queue
+import socket
+import pickle
+import struct
+import zipfile
+import tempfile
+import threading
+
+from typing import Dict, Iterator, List, Optional, Tuple
+from array import array
+from pathlib import Path
+
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+from vdb_flatfile import FlatfileHeader, Row
+
+DEBUG = 0
+
+METRIC_PREFIX = 'vdbench_'
+CARBON_PICKLE_PORT = 2004
+BATCH_SIZE = 500
+CHUNK_ROWS = 10000     # rows a column sink holds in memory before spooling them to disk
+
+###############################################################################
+
+
+class Sink:
+    '''A consumer of the parsed flatfile stream running on its own worker thread.
+
+    Events are queued to a bounded queue: by default rows are dropped and counted when
+    it is full, so a slow sink never holds up the others, with block=True a full queue
+    holds up the source instead (backpressure). Subclasses implement begin(), rows()
+    and end(), rows() is given up to BATCH_SIZE rows at once.
+    '''
+    name = 'sink'
+
+    def __init__(self, maxsize: int=10000, block: bool=False):
+        self.block = block
+        self.queue = queue.Queue(maxsize)
+        self.handled = 0
+        self.dropped = 0
+        self.errors = 0
+        self._thread = threading.Thread(target=self._run, name=f'sink_{self.name}', daemon=True)
+        self._thread.start()
+
+    def put(self, event: tuple):
+        if self.block or event[0] != 'row':
+            self.queue.put(event)   # begin/end are never dropped
+            return
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        self.queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        pending = []    # an event read while batching rows
+        while True:
+            event = pending.pop() if pending else self.queue.get()
+            if event is None:
+                break
+            try:
+                if event[0] == 'row':
+                    batch = [ event[1] ]
+                    while len(batch) < BATCH_SIZE:
+                        try:
+                            event = self.queue.get_nowait()
+                        except queue.Empty:
+                            break
+                        if event is None or event[0] != 'row':
+                            pending.append(event)
+                            break
+                        batch.append(event[1])
+                    self.rows(batch)
+                    self.handled += len(batch)
+                elif event[0] == 'begin':
+                    self.begin(event[1], event[2])
+                elif event[0] == 'end':
+                    self.end()
+            except Exception as e:
+                self.errors += 1
+                print(f'\nWARNING: {self.name} sink: {e}')
+
+    def begin(self, header: FlatfileHeader, labels: Dict[str, str]):
+        pass
+
+    def rows(self, rows: List[Row]):
+        pass
+
+    def end(self):
+        pass
+
+
+class Pipeline:
+    '''The source stage hands every event to each sink
+    '''
+    def __init__(self, sinks: List[Sink]):
+        self.sinks = sinks
+
+    def begin(self, header: FlatfileHeader, labels: Dict[str, str]):
+        for sink in self.sinks:
+            sink.put(('begin', header, dict(labels)))
+
+    def row(self, row: Row):
+        for sink in self.sinks:
+            sink.put(('row', row))
+
+    def close(self):
+        for sink in self.sinks:
+            sink.put(('end',))
+        for sink in self.sinks:
+            sink.close()
+
+
+class SinkCollector:
+    '''Expose the queue depth and counters of each sink on /metrics
+    '''
+    def __init__(self, pipeline: Pipeline):
+        self.pipeline = pipeline
+
+    def collect(self):
+        queued = GaugeMetricFamily(METRIC_PREFIX + 'sink_queued_events', 'Events waiting in the sink queue', labels=['sink'])
+        counters = { key: CounterMetricFamily(METRIC_PREFIX + f'sink_rows_{key}', f'Flatfile rows {key} by the sink', labels=['sink'])
+                     for key in ('handled', 'dropped') }
+        errors = CounterMetricFamily(METRIC_PREFIX + 'sink_errors', 'Sink failures', labels=['sink'])
+        for sink in self.pipeline.sinks:
+            queued.add_metric([sink.name], sink.queue.qsize())
+            counters['handled'].add_metric([sink.name], sink.handled)
+            counters['dropped'].add_metric([sink.name], sink.dropped)
+            errors.add_metric([sink.name], sink.errors)
+        yield queued
+        yield from counters.values()
+        yield errors
+
+
+class GraphiteSink(Sink):
+    '''Send rows to carbon with the pickle protocol, as vdb2graphite does
+    '''
+    name = 'graphite'
+
+    def __init__(self, server: str, pathroot: str, maxsize: int=10000, block: bool=False):
+        host, _, port = server.partition(':')
+        self.address = (host, int(port or CARBON_PICKLE_PORT))
+        self.pathroot = pathroot
+        self.sock = None
+        super().__init__(maxsize, block)
+
+    def begin(self, header: FlatfileHeader, labels: Dict[str, str]):
+        self.pathnames = [ self.pathroot + '.' + col for col in header.columns ]
+
+    def rows(self, rows: List[Row]):
+        metrics = []
+        for row in rows:
+            timestamp = int(row.timestamp)
+            for pathname, val in zip(self.pathnames, row.values):
+                if not math.isnan(val):    # n/a
+                    metrics.append((pathname, (timestamp, val)))
+        payload = pickle.dumps(metrics, protocol=2)
+        try:
+            if not self.sock:
+                self.sock = socket.create_connection(self.address, timeout=30)
+            self.sock.sendall(struct.pack('!L', len(payload)) + payload)
+        except OSError:
+            self.dropped += len(rows)
+            if self.sock:
+                self.sock.close()
+                self.sock = None
+            raise
+
+    def end(self):
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+
+
+class ColumnSink(Sink):
+    '''Collect the output as columns, spooled to disk every CHUNK_ROWS rows, and write the file
+    from the spooled columns at the end. Memory use is bounded whatever the length of the run.
+    '''
+    def __init__(self, directory: str, maxsize: int=10000, block: bool=False):
+        self.directory = Path(directory)
+        self.columns = None     # set by begin(), a flatfile without a header never opens
+        super().__init__(maxsize, block)
+
+    def begin(self, header: FlatfileHeader, labels: Dict[str, str]):
+        self.header = header
+        self.labels = labels
+        self.runs = []
+        self.count = 0          # rows spooled
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.spool = tempfile.TemporaryDirectory(prefix=f'.{self.name}_', dir=self.directory)
+        self.columns = self._chunk()
+
+    def _chunk(self) -> Dict[str, array]:
+        columns = { 'timestamp': array('d'), 'run': array('I') }     # run: index into self.runs
+        columns.update({ col: array('d') for col in self.header.columns })
+        return columns
+
+    def rows(self, rows: List[Row]):
+        runs = self.runs
+        timestamps, runcol = self.columns['timestamp'], self.columns['run']
+        values = [ self.columns[col] for col in self.header.columns ]
+        for row in rows:
+            if not runs or runs[-1] != row.run:
+                runs.append(row.run)
+            timestamps.append(row.timestamp)
+            runcol.append(len(runs) - 1)
+            for column, val in zip(values, row.values):
+                column.append(val)
+        if len(timestamps) >= CHUNK_ROWS:
+            self._spool()
+
+    def _spool(self):
+        for col, values in self.columns.items():
+            with open(Path(self.spool.name) / col, 'ab') as fd:
+                values.tofile(fd)
+        self.count += len(self.columns['timestamp'])
+        self.columns = self._chunk()
+
+    def chunks(self, *columns: str) -> Iterator[Tuple[array, ...]]:
+        '''Read the spooled columns back together, CHUNK_ROWS at a time
+        '''
+        fds = [ open(Path(self.spool.name) / col, 'rb') for col in columns ]
+        try:
+            for start in range(0, self.count, CHUNK_ROWS):
+                size = min(CHUNK_ROWS, self.count - start)
+                chunk = []
+                for col, fd in zip(columns, fds):
+                    values = array('I' if col == 'run' else 'd')
+                    values.fromfile(fd, size)
+                    chunk.append(values)
+                yield tuple(chunk)
+        finally:
+            for fd in fds:
+                fd.close()
+
+    def end(self):
+        if not self.columns:
+            return
+        try:
+            self._spool()
+            if self.count:
+                path = self.directory / (self.labels.get('resultdir', 'vdbench') + self.suffix)
+                tmp = path.with_name(path.name + '.tmp')
+                self.write(tmp)
+                os.replace(tmp, path)
+                print(f'\n{self.name}: wrote {self.count} intervals to: {path}')
+        finally:
+            self.spool.cleanup()
+            self.columns = None
+
+
+class OpenMetricsSink(ColumnSink):
+    '''Timestamped OpenMetrics text, ready for: promtool tsdb create-blocks-from openmetrics
+    '''
+    name = 'openmetrics'
+    suffix = '.om'
+
+    def write(self, path: Path):
+        # A metric family must not be interleaved with others, so the file is written a column at a time:
+        base = ','.join(f'{k}="{v}"' for k, v in self.labels.items() if k != 'run')
+        runlabels = [ f'{{{base},run="{run}"}}' if base else f'{{run="{run}"}}' for run in self.runs ]
+        with open(path, 'w') as fd:
+            for col in self.header.columns:
+                metric = METRIC_PREFIX + col
+                fd.write(f'# TYPE {metric} gauge\n')
+                for timestamps, runcol, values in self.chunks('timestamp', 'run', col):
+                    fd.writelines(f'{metric}{runlabels[r]} {v} {t:.3f}\n'
+                                  for r, v, t in zip(runcol, values, timestamps) if not math.isnan(v))
+            fd.write('# EOF\n')
+
+
+class ArchiveSink(ColumnSink):
+    '''Columnar archive: a zip of one little-endian float64 array per column (run is a
+    uint32 index into meta.json "runs"), e.g. numpy.frombuffer(zip.read('rate.f64'))
+    '''
+    name = 'archive'
+    suffix = '.zip'
+
+    def write(self, path: Path):
+        meta = { 'labels': { k: v for k, v in self.labels.items() if k != 'run' },
+                 'runs': self.runs, 'columns': list(self.columns), 'rows': self.count }
+        with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr('meta.json', json.dumps(meta, indent=1))
+            for col in self.columns:
+                ext = '.u32' if col == 'run' else '.f64'
+                with archive.open(col + ext, 'w', force_zip64=True) as entry:
+                    for values, in self.chunks(col):
+                        if sys.byteorder != 'little':
+                            values.byteswap()
+                        entry.write(values.tobytes())
@@ -0,0 +1,223 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Online steady state detection for Vdbench runs: rolling mean, variance and slope of rate and response time
+"""
+__author__  = "Mark Butterworth"
+__version__ = "0.1.1 20261019"
+__license__ = "MIT"
+
+# Ver 0.1.0 20261019  Initial version
+# Ver 0.1.1 20261019  Notify an orchestrator PID or command, stopping Vdbench is a separate explicit option
+
+# MIT License
+
+# Copyright (c) 2023 Mark Butterworth
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import json
+import math
+import shlex
+import signal
+import threading
+import subprocess
+
+from typing import Dict, List, Optional, Tuple
+from collections import deque
+from pathlib import Path
+
+from prometheus_client import CollectorRegistry, Gauge
+
+DEBUG = 0
+
+METRIC_PREFIX = 'vdbench_'
+STEADY_COLUMNS = ('rate', 'resp')
+
+###############################################################################
+
+
+class RollingStats:
+    '''Mean, variance and least squares slope (per sample) of the last size samples.
+
+    Running sums make each add() O(1), they are rebuilt from the window every size
+    samples so float rounding does not accumulate over a long run.
+    '''
+    def __init__(self, size: int):
+        self.size = size
+        self.values = deque()
+        self.x = 0           # index of the next sample
+        self._rebuild()
+
+    def _rebuild(self):
+        x0 = self.x - len(self.values)
+        self.sy = math.fsum(self.values)
+        self.syy = math.fsum(y * y for y in self.values)
+        self.sxy = math.fsum((x0 + i) * y for i, y in enumerate(self.values))
+
+    def add(self, y: float):
+        self.values.append(y)
+        self.sy += y
+        self.syy += y * y
+        self.sxy += self.x * y
+        self.x += 1
+        if len(self.values) > self.size:
+            old = self.values.popleft()
+            oldx = self.x - self.size - 1
+            self.sy -= old
+            self.syy -= old * old
+            self.sxy -= oldx * old
+        if self.x % self.size == 0:
+            self._rebuild()
+
+    def full(self) -> bool:
+        return len(self.values) == self.size
+
+    def mean(self) -> float:
+        return self.sy / len(self.values) if self.values else math.nan
+
+    def variance(self) -> float:
+        n = len(self.values)
+        return max(0.0, (self.syy - self.sy * self.sy / n) / (n - 1)) if n > 1 else math.nan
+
+    def slope(self) -> float:
+        n = len(self.values)
+        if n < 2:
+            return math.nan
+        xmean = self.x - n + (n - 1) / 2
+        return (self.sxy - xmean * self.sy) / (n * (n * n - 1) / 12)
+
+
+class SteadyStateStage:
+    '''Per run steady state of the STEADY_COLUMNS: over the window each column's coefficient
+    of variation must be within max_cv and its fitted drift (slope * window) within
+    max_slope, both relative to the window mean.
+
+    When first reached the time is published and optionally: a JSON marker file is
+    written, signo is sent to notify_pid (e.g. the orchestrator driving Vdbench) and/or
+    command is run, the marker path and command may use {hostname}, {resultdir} and {run}.
+    stop_signo is sent to the Vdbench process itself (stop_pid), which ends the whole
+    Vdbench job including any remaining runs, not only the current one.
+    '''
+    def __init__(self, columns: List[str], labelnames: List[str], registry: CollectorRegistry,
+                 window: int=30, max_cv: float=0.1, max_slope: float=0.1, marker: Optional[str]=None,
+                 notify_pid: Optional[int]=None, signo: int=signal.SIGUSR1, command: Optional[str]=None,
+                 stop_pid: Optional[int]=None, stop_signo: Optional[int]=None):
+        self.index = { col: columns.index(col) for col in STEADY_COLUMNS if col in columns }
+        self.window = window
+        self.max_cv = max_cv
+        self.max_slope = max_slope
+        self.marker = marker
+        self.notify_pid = notify_pid
+        self.signo = signo
+        self.command = command
+        self.stop_pid = stop_pid
+        self.stop_signo = stop_signo
+        self.steady = Gauge(METRIC_PREFIX + 'steady_state',
+            f'1 when {" and ".join(self.index)} are steady over the window', labelnames, registry=registry)
+        self.reached = Gauge(METRIC_PREFIX + 'steady_state_timestamp_seconds',
+            'Interval time the run first reached steady state', labelnames, registry=registry)
+        self.elapsed = Gauge(METRIC_PREFIX + 'steady_state_elapsed_seconds',
+            'Seconds from the start of the run to steady state', labelnames, registry=registry)
+        self.cv = Gauge(METRIC_PREFIX + 'steady_cv', 'Coefficient of variation over the window',
+            list(labelnames) + ['column'], registry=registry)
+        self.drift = Gauge(METRIC_PREFIX + 'steady_drift', 'Fitted change over the window relative to the mean',
+            list(labelnames) + ['column'], registry=registry)
+        self.run = None
+
+    def _reset(self, run: str, timestamp: float):
+        self.run = run
+        self.start = timestamp
+        self.first = None
+        self.stats = { col: RollingStats(self.window) for col in self.index }
+
+    def add(self, timestamp: float, values: Tuple[float, ...], labels: Dict[str, str]):
+        if not self.index:
+            return
+        if labels['run'] != self.run:
+            self._reset(labels['run'], timestamp)
+        steady = True
+        for col, stats in self.stats.items():
+            val = values[self.index[col]]
+            if math.isnan(val):
+                steady = False
+                continue
+            stats.add(val)
+            mean = stats.mean()
+            if not stats.full() or mean <= 0:
+                steady = False
+                continue
+            cv = math.sqrt(stats.variance()) / mean
+            drift = abs(stats.slope()) * self.window / mean
+            self.cv.labels(**labels, column=col).set(cv)
+            self.drift.labels(**labels, column=col).set(drift)
+            if cv > self.max_cv or drift > self.max_slope:
+                steady = False
+        self.steady.labels(**labels).set(1 if steady else 0)
+        if steady and self.first is None:
+            self.first = timestamp
+            self.reached.labels(**labels).set(timestamp)
+            self.elapsed.labels(**labels).set(timestamp - self.start)
+            print(f'\nSteady state reached: run={self.run} after {timestamp - self.start:.0f}s')
+            self._notify(labels)
+
+    def _notify(self, labels: Dict[str, str]):
+        means = { col: stats.mean() for col, stats in self.stats.items() }
+        record = dict(labels, timestamp=self.first, elapsed=self.first - self.start, means=means)
+        if self.marker:
+            try:
+                marker = Path(self.marker.format(**labels))
+                marker.parent.mkdir(parents=True, exist_ok=True)
+                tmp = marker.with_name(marker.name + '.tmp')
+                tmp.write_text(json.dumps(record) + '\n')
+                os.replace(tmp, marker)
+                print(f'Steady state marker: {marker}')
+            except (OSError, KeyError, ValueError) as e:
+                print(f'WARNING: Cannot write steady state marker {self.marker}: {e}')
+        if self.notify_pid:
+            _signal(self.notify_pid, self.signo, 'orchestrator')
+        if self.command:
+            try:
+                cmd = [ arg.format(**labels) for arg in shlex.split(self.command) ]
+            except (KeyError, ValueError) as e:
+                print(f'WARNING: Invalid steady state command {self.command}: {e}')
+            else:
+                env = dict(os.environ, VDB_STEADY_STATE=json.dumps(record))
+                threading.Thread(target=_run_command, args=(cmd, env), name='steady_command', daemon=True).start()
+        if self.stop_pid and self.stop_signo:
+            _signal(self.stop_pid, self.stop_signo, 'Vdbench')
+
+
+def _signal(pid: int, signo: int, what: str):
+    try:
+        os.kill(pid, signo)
+        print(f'Sent {signal.Signals(signo).name} to {what} PID: {pid}')
+    except OSError as e:
+        print(f'WARNING: Cannot signal {what} PID {pid}: {e}')
+
+
+def _run_command(cmd: List[str], env: Dict[str, str]):
+    # On its own thread so a slow command does not hold up the rows, run() also reaps it
+    try:
+        result = subprocess.run(cmd, env=env, stdin=subprocess.DEVNULL)
+        if result.returncode:
+            print(f'WARNING: Steady state command exited {result.returncode}: {" ".join(cmd)}')
+    except OSError as e:
+        print(f'WARNING: Cannot run steady state command {" ".join(cmd)}: {e}')
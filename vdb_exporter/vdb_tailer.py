@@ -0,0 +1,268 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Follow many Vdbench output files on one thread using inotify + epoll (polling where unavailable)
+"""
+__author__  = "Mark Butterworth"
+__version__ = "0.1.0 20261019"
+__license__ = "MIT"
+
+# Ver 0.1.0 20261019  Initial version
+
+# MIT License
+
+# Copyright (c) 2023 Mark Butterworth
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import re
+import time
+import select
+import struct
+import ctypes
+import ctypes.util
+import threading
+
+from typing import Callable, Dict, List, Tuple, Optional, Set
+from pathlib import Path
+
+DEBUG = 0
+
+# inotify(7) event masks:
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_EVENT = struct.Struct('iIII')   # wd, mask, cookie, len (followed by name)
+
+RESCAN_INTERVAL = 5.0   # Safety net for filesystems without inotify support (e.g. NFS)
+
+# Files vdbench writes in the output directory that are not per host/slave reports:
+NOT_HOST_FILES = {
+    'anchors', 'config', 'errorlog', 'flatfile', 'histogram', 'logfile', 'parmfile',
+    'status', 'summary', 'totals', 'index', 'swat_mon',
+}
+SLAVE_MATCH = re.compile(r'^(?P<host>.+)-(?P<slave>\d+)\.html$')
+HD_MATCH = re.compile(r'^\s*hd=([^,\s]+)', re.IGNORECASE)
+RUN_MATCH = re.compile(r'\bRD=([^;,\s]+)')
+TOD_MATCH = re.compile(r'^\d\d:\d\d:\d\d(\.\d+)?$')
+
+# Column order of the per host/slave interval reports (same layout as summary.html):
+#   tod interval i/o-rate MB/sec bytes/io read-pct resp read-resp write-resp resp-max resp-stddev queue-depth cpu%-sys+u cpu%-sys
+INTERVAL_COLUMNS = [ 'rate', 'mb_sec', 'bytes_io', 'read_pct', 'resp', 'read_resp', 'write_resp',
+                     'resp_max', 'resp_stddev', 'queue_depth', 'cpu_used', 'cpu_sys' ]
+
+LineHandler = Callable[[str], None]
+
+###############################################################################
+
+
+class _Inotify:
+    '''Minimal ctypes binding for inotify, returns None from create() when not available
+    '''
+    def __init__(self, libc, fd: int):
+        self._libc = libc
+        self.fd = fd
+
+    @classmethod
+    def create(cls) -> Optional['_Inotify']:
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or None, use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        except (OSError, AttributeError):
+            return None
+        return cls(libc, fd) if fd >= 0 else None
+
+    def watch(self, directory: Path) -> bool:
+        mask = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+        return self._libc.inotify_add_watch(self.fd, os.fsencode(directory), mask) >= 0
+
+    def read_names(self) -> Set[str]:
+        names = set()
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return names
+        pos = 0
+        while pos + IN_EVENT.size <= len(data):
+            _, _, _, size = IN_EVENT.unpack_from(data, pos)
+            pos += IN_EVENT.size
+            names.add(os.fsdecode(data[pos:pos+size].rstrip(b'\0')))
+            pos += size
+        return names
+
+    def close(self):
+        os.close(self.fd)
+
+
+class _Followed:
+    def __init__(self, path: Path, handler: LineHandler):
+        self.path = path
+        self.handler = handler
+        self.fd = open(path, 'rb')
+        self.partial = b''
+
+    def read(self):
+        data = self.fd.read()
+        if not data:
+            return
+        lines = (self.partial + data).split(b'\n')
+        self.partial = lines.pop()
+        for line in lines:
+            self.handler(line.decode(errors='replace'))
+
+
+class MultiTailer:
+    '''Follow every file in a directory that discover() returns a line handler for.
+
+    One thread waits on an inotify descriptor with epoll and only reads the files that
+    changed, so the cost is proportional to the data written rather than the number of
+    files. Falls back to polling all files when inotify is not available.
+    '''
+    def __init__(self, directory: Path, discover: Callable[[str], Optional[LineHandler]], poll: float=0.25):
+        self.directory = Path(directory)
+        self.discover = discover
+        self.poll = poll
+        self.files: Dict[str, _Followed] = {}
+        self._ignored: Set[str] = set()
+
+    def scan(self):
+        for path in self.directory.iterdir():
+            name = path.name
+            if name in self.files or name in self._ignored or not path.is_file():
+                continue
+            handler = self.discover(name)
+            if handler is None:
+                self._ignored.add(name)
+                continue
+            try:
+                self.files[name] = _Followed(path, handler)
+            except OSError as e:
+                print(f'\nWARNING: Cannot follow {path}: {e}')
+                continue
+            if DEBUG:
+                print(f'Following: {path}')
+
+    def run(self, stop: threading.Event, alive: Optional[Callable[[], bool]]=None):
+        inotify = _Inotify.create()
+        epoll = None
+        if inotify and inotify.watch(self.directory):
+            epoll = select.epoll()
+            epoll.register(inotify.fd, select.EPOLLIN)
+        elif DEBUG:
+            print(f'inotify not available, polling: {self.directory}')
+
+        try:
+            self.scan()
+            for followed in self.files.values():
+                followed.read()
+            last_rescan = last_alive = time.monotonic()
+            while not stop.is_set():
+                changed = None      # None = poll fallback, every followed file is read
+                if epoll:
+                    if epoll.poll(self.poll):
+                        changed = inotify.read_names()
+                    else:
+                        changed = set()   # Idle, only the periodic rescan reads anything
+                else:
+                    stop.wait(self.poll)
+
+                now = time.monotonic()
+                if changed is None or now - last_rescan >= RESCAN_INTERVAL:
+                    self.scan()
+                    changed = set(self.files)
+                    last_rescan = now
+                elif changed - set(self.files):
+                    self.scan()
+
+                for name in changed:
+                    followed = self.files.get(name)
+                    if followed:
+                        followed.read()
+
+                if alive and now - last_alive >= 1.0:
+                    last_alive = now
+                    if not alive():
+                        break
+            for followed in self.files.values():
+                followed.read()   # Pick up anything written before the stop
+        finally:
+            for followed in self.files.values():
+                followed.fd.close()
+            self.files.clear()
+            if epoll:
+                epoll.close()
+            if inotify:
+                inotify.close()
+
+
+###############################################################################
+
+
+def vdb_hosts(directory: Path) -> Set[str]:
+    '''Host labels (hd=) from the parmfile, vdbench uses localhost when none are defined
+    '''
+    hosts = { 'localhost' }
+    try:
+        with open(Path(directory) / 'parmfile.html', 'r', errors='replace') as fd:
+            for line in fd:
+                match = HD_MATCH.match(line)
+                if match and match.group(1).lower() != 'default':
+                    hosts.add(match.group(1))
+    except OSError:
+        pass
+    return hosts
+
+
+def host_slave(name: str, hosts: Set[str]) -> Optional[Tuple[str, str]]:
+    '''Return (host, slave) for a per host (<host>.html) or per slave (<host>-<n>.html) report
+    '''
+    match = SLAVE_MATCH.match(name)
+    if match:
+        return match.group('host'), match.group('slave')
+    if name.endswith('.html'):
+        host = name[:-5]
+        if host in hosts and host not in NOT_HOST_FILES:
+            return host, ''
+    return None
+
+
+class IntervalParser:
+    '''Parse interval report lines, calling report(run, values) for every non average interval
+    '''
+    def __init__(self, report: Callable[[str, Dict[str, float]], None]):
+        self.report = report
+        self.run = ''
+
+    def __call__(self, line: str):
+        match = RUN_MATCH.search(line)
+        if match:
+            self.run = match.group(1)
+            return
+        values = line.split()
+        if len(values) < 3 or not TOD_MATCH.match(values[0]) or not values[1].isdigit():
+            return    # Headers, messages and avg_ lines
+        row = {}
+        for col, val in zip(INTERVAL_COLUMNS, values[2:]):
+            try:
+                row[col] = float(val)
+            except ValueError:
+                row[col] = 0.0    # n/a
+        self.report(self.run, row)
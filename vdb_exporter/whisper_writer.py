@@ -0,0 +1,213 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Write complete Graphite Whisper (.wsp) files in bulk, honouring the carbon schema and aggregation rules
+"""
+__author__  = "Mark Butterworth"
+__version__ = "0.1.1 20261019"
+__license__ = "MIT"
+
+# Ver 0.1.0 20261019  Initial version
+# Ver 0.1.1 20261019  The highest precision archive keeps the last point per slot, as carbon does
+
+# MIT License
+
+# Copyright (c) 2023 Mark Butterworth
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import re
+import struct
+import configparser
+
+from typing import Dict, List, Tuple
+from pathlib import Path
+
+DEBUG = 0
+
+SCHEMAS_FILE = 'storage-schemas.conf'
+AGGREGATION_FILE = 'storage-aggregation.conf'
+
+# Whisper on-disk format (all big endian):
+#   Metadata:     aggregationType, maxRetention, xFilesFactor, archiveCount
+#   ArchiveInfo:  offset, secondsPerPoint, points   (one per archive)
+#   Point:        timestamp, value                  (points per archive, circular)
+METADATA = struct.Struct('!2LfL')
+ARCHIVE_INFO = struct.Struct('!3L')
+POINT = struct.Struct('!Ld')
+
+AGGREGATION_TYPES = {
+    'average': 1, 'sum': 2, 'last': 3, 'max': 4, 'min': 5, 'avg_zero': 6, 'absmax': 7, 'absmin': 8,
+}
+UNIT_SECONDS = {
+    's': 1, 'sec': 1, 'second': 1, 'seconds': 1,
+    'm': 60, 'min': 60, 'minute': 60, 'minutes': 60,
+    'h': 3600, 'hour': 3600, 'hours': 3600,
+    'd': 86400, 'day': 86400, 'days': 86400,
+    'w': 604800, 'week': 604800, 'weeks': 604800,
+    'y': 31536000, 'year': 31536000, 'years': 31536000,
+}
+RETENTION_MATCH = re.compile(r'^(\d+)([a-z]*)$')
+
+# [(secondsPerPoint, points), ...] highest precision first
+Archives = List[Tuple[int, int]]
+
+###############################################################################
+
+
+def _seconds(value: str) -> Tuple[int, bool]:
+    match = RETENTION_MATCH.match(value.strip().lower())
+    if not match or (match.group(2) and match.group(2) not in UNIT_SECONDS):
+        raise ValueError(f'Invalid retention value: {value}')
+    return int(match.group(1)) * UNIT_SECONDS.get(match.group(2), 1), bool(match.group(2))
+
+
+def parse_retentions(retentions: str) -> Archives:
+    '''Parse e.g. "10s:6h,1m:6d,10m:1800d" (a points value without units is a point count)
+    '''
+    archives = []
+    for defn in retentions.split(','):
+        precision, points = defn.split(':')
+        spp, _ = _seconds(precision)
+        duration, has_units = _seconds(points)
+        archives.append((spp, duration // spp if has_units else duration))
+    archives.sort()
+    for (spp, points), (nextspp, nextpoints) in zip(archives, archives[1:]):
+        if nextspp % spp or nextspp * nextpoints <= spp * points:
+            raise ValueError(f'Invalid retentions, lower precisions must divide and retain longer: {retentions}')
+    return archives
+
+
+class StorageRules:
+    '''First match wins rules from carbon storage-schemas.conf and storage-aggregation.conf
+    '''
+    def __init__(self, confdir: Path):
+        self.schemas = []
+        self.aggregations = []
+        parser = configparser.RawConfigParser()
+        if not parser.read(Path(confdir) / SCHEMAS_FILE):
+            raise FileNotFoundError(f'Cannot read: {Path(confdir) / SCHEMAS_FILE}')
+        for section in parser.sections():
+            self.schemas.append((re.compile(parser.get(section, 'pattern')),
+                                 parse_retentions(parser.get(section, 'retentions'))))
+
+        parser = configparser.RawConfigParser()
+        parser.read(Path(confdir) / AGGREGATION_FILE)
+        for section in parser.sections():
+            method = parser.get(section, 'aggregationMethod', fallback='average')
+            if method not in AGGREGATION_TYPES:
+                raise ValueError(f'Invalid aggregationMethod in [{section}]: {method}')
+            self.aggregations.append((re.compile(parser.get(section, 'pattern')), method,
+                                      parser.getfloat(section, 'xFilesFactor', fallback=0.5)))
+
+    def archives(self, metric: str) -> Archives:
+        for pattern, archives in self.schemas:
+            if pattern.search(metric):
+                return archives
+        raise ValueError(f'No storage schema matches: {metric}')
+
+    def aggregation(self, metric: str) -> Tuple[str, float]:
+        for pattern, method, xff in self.aggregations:
+            if pattern.search(metric):
+                return method, xff
+        return 'average', 0.5    # carbon's default
+
+
+def aggregate(method: str, values: List[float], slots: int) -> float:
+    if method == 'average':
+        return sum(values) / len(values)
+    if method == 'sum':
+        return sum(values)
+    if method == 'last':
+        return values[-1]
+    if method == 'max':
+        return max(values)
+    if method == 'min':
+        return min(values)
+    if method == 'avg_zero':
+        return sum(values) / max(slots, len(values))
+    if method == 'absmax':
+        return max(values, key=abs)
+    if method == 'absmin':
+        return min(values, key=abs)
+    raise ValueError(f'Unsupported aggregation method: {method}')
+
+
+def build_archives(points: Dict[int, float], archives: Archives, method: str, xff: float) -> List[Dict[int, float]]:
+    '''Pre-aggregate the points for every archive as carbon would store them: a point
+    written to the highest precision archive overwrites its slot, so the last one wins,
+    and each lower precision archive is aggregated from the one above
+    '''
+    spp = archives[0][0]
+    level = { timestamp - timestamp % spp: points[timestamp] for timestamp in sorted(points) }
+    levels = [ level ]
+    for (sourcespp, _), (spp, _) in zip(archives, archives[1:]):
+        buckets = {}
+        for timestamp in sorted(level):
+            buckets.setdefault(timestamp - timestamp % spp, []).append(level[timestamp])
+        slots = spp // sourcespp
+        level = { timestamp: aggregate(method, values, slots) for timestamp, values in buckets.items()
+                  if len(values) / slots >= xff }
+        levels.append(level)
+    return levels
+
+
+def whisper_bytes(levels: List[Dict[int, float]], archives: Archives, method: str, xff: float) -> bytes:
+    header_size = METADATA.size + ARCHIVE_INFO.size * len(archives)
+    max_retention = max(spp * npoints for spp, npoints in archives)
+    parts = [ METADATA.pack(AGGREGATION_TYPES[method], max_retention, xff, len(archives)) ]
+    offset = header_size
+    for spp, npoints in archives:
+        parts.append(ARCHIVE_INFO.pack(offset, spp, npoints))
+        offset += npoints * POINT.size
+
+    for level, (spp, npoints) in zip(levels, archives):
+        data = bytearray(npoints * POINT.size)
+        if level:
+            last = max(level)
+            kept = [ t for t in level if t > last - npoints * spp ]
+            # Whisper takes the point in slot 0 as the archive's base interval:
+            base = min(kept)
+            for timestamp in kept:
+                slot = (timestamp - base) // spp % npoints
+                POINT.pack_into(data, slot * POINT.size, timestamp, level[timestamp])
+        parts.append(bytes(data))
+    return b''.join(parts)
+
+
+def write_whisper(path: Path, points: Dict[int, float], rules: StorageRules, metric: str) -> int:
+    '''Write a complete .wsp file with one sequential write, returns the file size
+    '''
+    archives = rules.archives(metric)
+    method, xff = rules.aggregation(metric)
+    levels = build_archives(points, archives, method, xff)
+    data = whisper_bytes(levels, archives, method, xff)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmppath = path.with_name(path.name + '.tmp')
+    with open(tmppath, 'wb') as fd:
+        fd.write(data)
+    os.replace(tmppath, path)
+    if DEBUG:
+        print(f'{path}: {method} xff={xff} archives={archives} points={[len(l) for l in levels]}')
+    return len(data)
+
+
+def whisper_path(storagedir: Path, metric: str) -> Path:
+    return Path(storagedir) / (metric.replace('.', os.sep) + '.wsp')